@@ -5,10 +5,18 @@ class MovieAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'release_date', 'subtitles_file')
     list_display_links = ('title', )
 
+class WordFrequenciesAdmin(admin.ModelAdmin):
+    list_display = ('id', 'movie', 'tokenizer_version', 'subtitles_hash')
+    list_display_links = ('id', )
+
 class GameAdmin(admin.ModelAdmin):
     list_display = ('id', 'number_of_players', 'intoxication_level', 'movie')
     list_display_links = ('id', )
 
+class GameJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'movie_id', 'movie_title', 'number_of_players', 'intoxication_level', 'game')
+    list_display_links = ('id', )
+
 class RatingAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'game', 'rating')
     list_display_links = ('id', )
@@ -16,4 +24,6 @@ class RatingAdmin(admin.ModelAdmin):
 admin.site.register(User)
 admin.site.register(Game, GameAdmin)
 admin.site.register(Movie, MovieAdmin)
-admin.site.register(Rating, RatingAdmin)
\ No newline at end of file
+admin.site.register(Rating, RatingAdmin)
+admin.site.register(WordFrequencies, WordFrequenciesAdmin)
+admin.site.register(GameJob, GameJobAdmin)
\ No newline at end of file
@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+
+from .exceptions import *
+from .generator import WORD_FINDERS
+
+# Word finder that is created once in each worker process, so that the
+# stopwords set and POS tagger model stay loaded between jobs
+worker_word_finder = None
+
+def initialize_worker(word_finder):
+    global worker_word_finder
+    worker_word_finder = WORD_FINDERS[word_finder]()
+
+    # Tag a single word so that the averaged perceptron tagger is loaded before
+    # the first real job arrives
+    worker_word_finder.count_words(['warm up'])
+
+def analyze_texts(texts):
+    return worker_word_finder.count_words(texts)
+
+class SubtitleAnalyzer(object):
+
+    def __init__(self, workers=2, queue_size=4, timeout=60, word_finder='nltk'):
+        # Subtitle analysis is CPU bound, so it is run in separate processes
+        # instead of the request thread. If workers is 0, subtitles are
+        # analysed inline.
+        self.workers = workers
+        self.timeout = timeout
+
+        # Name of the word finder from generator.WORD_FINDERS that is used to
+        # find nouns. Its version is part of the cached word frequencies key.
+        self.word_finder = word_finder
+        self.word_finder_class = WORD_FINDERS[word_finder]
+        self.version = self.word_finder_class.VERSION
+        self.executor = None
+        self.lock = threading.Lock()
+
+        # Word finder used when subtitles are analysed inline, it is created
+        # on first use or by preload
+        self.inline_word_finder = None
+
+        # At most workers + queue_size jobs can be running or waiting at the
+        # same time, all other requests are rejected immediately
+        self.slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Workers are spawned instead of forked, because forking a
+                # multithreaded web server worker is not safe
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=initialize_worker,
+                    initargs=(self.word_finder, )
+                )
+            return self.executor
+
+    def reset_executor(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+    def get_inline_word_finder(self):
+        with self.lock:
+            if self.inline_word_finder is None:
+                self.inline_word_finder = self.word_finder_class()
+            return self.inline_word_finder
+
+    def preload(self):
+        """Load the NLP models now instead of on the first request"""
+        # Worker processes load their own models when they are started, so
+        # only the inline word finder can be preloaded. The process pool must
+        # not be created before the web server forks.
+        if self.workers <= 0:
+            self.get_inline_word_finder().count_words(['warm up'])
+
+    def get_words(self, movie, subtitles):
+        """Return the list of nouns and their frequencies in subtitles of movie"""
+        if self.workers <= 0:
+            return self.get_inline_word_finder().get_words(subtitles)
+
+        if not self.slots.acquire(blocking=False):
+            raise ServerBusyException()
+
+        # Subtitles generator can not be sent to another process, so only the
+        # subtitle texts are sent
+        try:
+            texts = [subtitle.content for subtitle in subtitles]
+            executor = self.get_executor()
+            future = executor.submit(analyze_texts, texts)
+        except Exception:
+            self.slots.release()
+            raise
+
+        # The slot is only released once the job has actually finished, so
+        # jobs that timed out still count towards the queue size
+        future.add_done_callback(lambda future: self.slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise AnalysisTimeoutException(movie.title)
+        except BrokenProcessPool:
+            # One of the workers has died, a new pool will be created for the
+            # next job
+            self.reset_executor(executor)
+            raise ServerBusyException()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
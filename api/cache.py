@@ -0,0 +1,135 @@
+from collections import OrderedDict, defaultdict
+import hashlib
+import threading
+import time
+
+class MemoryCacheBackend(object):
+    """In-process cache with least recently used eviction"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class DjangoCacheBackend(object):
+    """Cache backend that uses one of the caches configured in Django settings"""
+
+    def __init__(self, alias='default', prefix='response'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def get_key(self, key):
+        # Keys contain search queries, which can be longer than or contain
+        # characters that are not allowed in memcached keys
+        return '{}:{}'.format(self.prefix, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.cache.get(self.get_key(key))
+
+    def set(self, key, value, timeout):
+        self.cache.set(self.get_key(key), value, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+class ResponseCache(object):
+
+    def __init__(self, backend=None, ttl=None, stale_ttl=None):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+
+        # Number of seconds the responses of each endpoint are considered
+        # fresh. Endpoints that are not listed are not cached.
+        self.ttl = ttl if ttl is not None else {}
+
+        # Number of seconds after the response is no longer fresh during which
+        # the stale response is still returned while a new one is downloaded
+        # in the background (stale-while-revalidate)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else {}
+
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.stale_hits = defaultdict(int)
+
+    def get_or_set(self, endpoint, key, fetch):
+        """Return cached response for key, calling fetch() when it is missing"""
+        ttl = self.ttl.get(endpoint, 0)
+        if ttl <= 0:
+            return fetch()
+
+        cache_key = '{}:{}'.format(endpoint, key)
+        entry = self.backend.get(cache_key)
+        if entry is None:
+            self.misses[endpoint] += 1
+            return self.fetch(endpoint, cache_key, fetch)
+
+        value, fresh_until = entry
+        if time.time() < fresh_until:
+            self.hits[endpoint] += 1
+        else:
+            self.stale_hits[endpoint] += 1
+            self.revalidate(endpoint, cache_key, fetch)
+        return value
+
+    def fetch(self, endpoint, cache_key, fetch):
+        value = fetch()
+        ttl = self.ttl.get(endpoint, 0)
+        stale_ttl = self.stale_ttl.get(endpoint, 0)
+        self.backend.set(cache_key, (value, time.time() + ttl), ttl + stale_ttl)
+        return value
+
+    def revalidate(self, endpoint, cache_key, fetch):
+        # Only one background refresh per key is run at the same time
+        with self.lock:
+            if cache_key in self.refreshing:
+                return
+            self.refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self.fetch(endpoint, cache_key, fetch)
+            except Exception as e:
+                print('Cached response {} could not be refreshed: {}'.format(cache_key, e))
+            finally:
+                with self.lock:
+                    self.refreshing.discard(cache_key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def stats(self):
+        endpoints = set(self.hits) | set(self.misses) | set(self.stale_hits)
+        return {
+            endpoint: {
+                "hits": self.hits[endpoint],
+                "misses": self.misses[endpoint],
+                "stale_hits": self.stale_hits[endpoint]
+            } for endpoint in endpoints
+        }
@@ -33,4 +33,32 @@ class GameGenerationException(ApiException):
 
 class GameNotFoundException(ApiException):
     def __init__(self, game_id):
-        super().__init__(5, "Game with id {} not found".format(game_id))
\ No newline at end of file
+        super().__init__(5, "Game with id {} not found".format(game_id))
+
+class ServerBusyException(ApiException):
+    def __init__(self):
+        super().__init__(8, "The server is busy, please try again later")
+
+class AnalysisTimeoutException(ApiException):
+    def __init__(self, movie_title):
+        super().__init__(9, "Subtitles for movie {} could not be analysed in time, please try again later".format(movie_title))
+
+class GameJobNotFoundException(ApiException):
+    def __init__(self, job_id):
+        super().__init__(5, "Game job with id {} not found".format(job_id))
+
+class BatchTooLargeException(ApiException):
+    def __init__(self, maximum):
+        super().__init__(10, "At most {} games can be generated at once".format(maximum))
+
+class SubtitleServiceUnavailableException(ApiException):
+    def __init__(self):
+        super().__init__(11, "Subtitles service is currently unavailable, please try again later")
+
+class InvalidParameterValueException(ApiException):
+    def __init__(self, parameter_name, minimum):
+        super().__init__(12, "Parameter {} must be at least {}".format(parameter_name, minimum))
+
+class ParameterValueTooLargeException(ApiException):
+    def __init__(self, parameter_name, maximum):
+        super().__init__(13, "Parameter {} must be at most {}".format(parameter_name, maximum))
\ No newline at end of file
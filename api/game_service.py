@@ -0,0 +1,268 @@
+from django.core.files import File
+from django.db import connection, transaction
+
+from .exceptions import *
+from .models import Movie, Game
+from .generator import DrinkingGame, WordIndex
+from .analyzer import SubtitleAnalyzer
+from .locks import FileLock
+from .subtitle_service import parse_subtitles_file
+from . import subtitle_store
+
+import os
+import srt
+import tempfile
+import json
+import random
+
+class GameService(object):
+
+    def __init__(self, subtitle_service, analyzer=None, lock_directory=None, lock_timeout=120, pool_size=0, pool_prior_rating=2.5,
+                 compress_subtitles=False, max_players=20, max_intoxication_level=100, max_bonus_words=10):
+        # The subtitle service is used to get movie information from TMDB and
+        # subtitles from OpenSubtitles
+        self.subtitle_service = subtitle_service
+
+        # The analyzer finds nouns in subtitles, by default in the current
+        # process
+        self.analyzer = analyzer if analyzer is not None else SubtitleAnalyzer(workers=0)
+
+        # Subtitles for each movie are downloaded and analysed by only one
+        # request at a time, see get_words
+        self.lock_directory = lock_directory
+        self.lock_timeout = lock_timeout
+
+        # Number of stored games with the same parameters that are kept for
+        # each movie, see get_game. If it is 0, a new game is always generated.
+        self.pool_size = pool_size
+        self.pool_prior_rating = pool_prior_rating
+
+        # Compressed subtitles use less disk space, but they can not be memory
+        # mapped and are decompressed on each read
+        self.compress_subtitles = compress_subtitles
+
+        # Limits of game parameters, so that a single request can not use a
+        # lot of CPU time to generate huge games
+        self.max_players = max_players
+        self.max_intoxication_level = max_intoxication_level
+        self.max_bonus_words = max_bonus_words
+
+    def get_movie(self, movie_id=None, movie_title=None):
+        # The movie_id argument is only present when user clicks on a suggestion
+        # card inside suggestions adapter in Android app. If both, movie_id and
+        # movie arguments are present, the movie_id parameter is used beucase it
+        # uniquely describes our movie.
+        if movie_id is not None:
+            return self.get_stored_movie(movie_id)
+
+        # If movie_id is None and movie_title isn't, then we must perform two
+        # requests to TMDB API. First, we use movie_title to get a list of
+        # suggestions and then use the most probable suggestion from this list.
+        if movie_title is not None:
+            suggestions, _ = self.subtitle_service.get_suggestions(movie_title)
+
+            if suggestions is None or len(suggestions) <= 0:
+                raise MovieNotFoundException(movie_title)
+            
+            return self.get_stored_movie(suggestions[0].id)
+
+        raise InvalidParametersException('movie or movie_id')
+
+    def get_stored_movie(self, movie_id):
+        try:
+            return Movie.objects.get(id=movie_id)
+        except Movie.DoesNotExist:
+            # There was an error loading movie from local database, get movie
+            # from TMDB service and save it to local database. The response
+            # also contains IMDB id, so TMDB is not queried again when
+            # subtitles are downloaded.
+            movie = self.subtitle_service.get_movie(movie_id)
+            movie.save()
+            return movie
+
+    def get_subtitles(self, movie):
+        # After movie information has either been downloaded or read from local
+        # database, find its subtitles. The subtitles might have already been
+        # downloaded. In this case, they are only read from disk.
+        if not movie.subtitles_file:
+            # Downloaded subtitles are written to a temporary file, which is
+            # then converted and saved to storage
+            subtitle_file_path = self.subtitle_service.get_subtitles(movie)
+            try:
+                self.save_subtitles(movie, parse_subtitles_file(subtitle_file_path))
+            finally:
+                os.remove(subtitle_file_path)
+        elif movie.subtitles_format != subtitle_store.VERSION:
+            # Subtitles that were saved as srt files are converted when they
+            # are first needed
+            old_subtitles_file = movie.subtitles_file.name
+            try:
+                self.save_subtitles(movie, parse_subtitles_file(movie.subtitles_file.url))
+            except Exception as e:
+                # Subtitles that can not be converted are still read the way
+                # they were before
+                print('Subtitles for {} could not be converted: {}'.format(movie, e))
+                with open(movie.subtitles_file.url, 'r', encoding='utf-8') as subtitle_file:
+                    return srt.parse(subtitle_file.read())
+            movie.subtitles_file.storage.delete(old_subtitles_file)
+
+        # Cues are read without parsing, the whole file is never in memory at
+        # once
+        return subtitle_store.read_subtitles(movie.subtitles_file.url)
+
+    def save_subtitles(self, movie, subtitles):
+        old_subtitles_file, old_subtitles_format = movie.subtitles_file.name, movie.subtitles_format
+        with tempfile.TemporaryFile() as subtitle_file:
+            subtitle_store.write_subtitles(subtitles, subtitle_file, compress=self.compress_subtitles)
+            subtitle_file.seek(0)
+            movie.subtitles_file.save("{}.subs".format(movie.id), File(subtitle_file), save=False)
+
+        movie.subtitles_format = subtitle_store.VERSION
+        try:
+            movie.save()
+        except Exception:
+            # The movie still points to its previous subtitles
+            movie.subtitles_file.storage.delete(movie.subtitles_file.name)
+            movie.subtitles_file.name, movie.subtitles_format = old_subtitles_file, old_subtitles_format
+            raise
+
+    def get_words(self, movie):
+        # Word frequencies for this movie might have already been computed when a
+        # previous game was generated. In this case, subtitles don't need to be
+        # parsed and tagged again.
+        words = movie.get_word_frequencies(self.analyzer.version)
+        if words is not None:
+            return words
+
+        # When a movie becomes popular, many requests for it arrive before its
+        # subtitles are downloaded. Only the first one downloads and analyses
+        # them, the others wait for the lock and then read its result.
+        lock_name = 'movie-{}'.format(movie.id)
+        with FileLock(lock_name, directory=self.lock_directory, timeout=self.lock_timeout):
+            movie.refresh_from_db()
+            words = movie.get_word_frequencies(self.analyzer.version)
+            if words is None:
+                subtitle_generator = self.get_subtitles(movie)
+                words = self.analyzer.get_words(movie, subtitle_generator)
+                movie.save_word_frequencies(self.analyzer.version, words)
+        return words
+
+    def create_game(self, movie, words, number_of_players, intoxication_level, number_of_bonus_words=1, created_by=None):
+        """Generate a new drinking game for movie, the returned Game is not saved yet"""
+        # Games without players or shots can not be played or displayed
+        if number_of_players < 1:
+            raise InvalidParameterValueException('players', 1)
+        if intoxication_level < 1:
+            raise InvalidParameterValueException('intoxication', 1)
+        if number_of_bonus_words < 0:
+            raise InvalidParameterValueException('bonus_words', 0)
+        if number_of_players > self.max_players:
+            raise ParameterValueTooLargeException('players', self.max_players)
+        if intoxication_level > self.max_intoxication_level:
+            raise ParameterValueTooLargeException('intoxication', self.max_intoxication_level)
+        if number_of_bonus_words > self.max_bonus_words:
+            raise ParameterValueTooLargeException('bonus_words', self.max_bonus_words)
+
+        game = DrinkingGame(
+            movie,
+            words,
+            number_of_players,
+            intoxication_level,
+            number_of_bonus_words
+        )
+        game_json = game.to_dict(self.subtitle_service)
+
+        # If there was an exception during game generation process, it will
+        # be raised here. Once game has been successfully generated, it can be
+        # saved to local database. The game id will be generated automatically
+        # by Django.
+        return Game(
+            number_of_players=game.number_of_players,
+            intoxication_level=game.intoxication_level,
+            number_of_bonus_words=game.number_of_bonus_words,
+            game_data=json.dumps(game_json),
+            movie=movie,
+            created_by=created_by
+        )
+
+    def generate_game(self, movie, number_of_players, intoxication_level, created_by=None):
+        """Generate a new drinking game for movie and save it to local database"""
+        words = self.get_words(movie)
+
+        # Here, word frequencies have been computed, now we can create game
+        game = self.create_game(movie, words, number_of_players, intoxication_level, created_by=created_by)
+        game.save()
+
+        # The game id is only known after the game is saved, then it is
+        # included in game data, so that it can be served as is
+        game.serialize()
+        game.save(update_fields=['game_data', 'serialized', 'updated_at'])
+        return game
+
+    def get_game(self, movie, number_of_players, intoxication_level, created_by=None):
+        """Return a stored game with given parameters or generate a new one"""
+        if self.pool_size <= 0:
+            return self.generate_game(movie, number_of_players, intoxication_level, created_by=created_by)
+
+        # New games are only generated until there are pool_size games with
+        # the same parameters, after that one of the best rated ones is reused
+        pool = list(Game.objects.filter(
+            movie=movie,
+            number_of_players=number_of_players,
+            intoxication_level=intoxication_level,
+            number_of_bonus_words=1
+        ).order_by('-rating_average', '-rating_count')[:self.pool_size])
+
+        if len(pool) < self.pool_size:
+            return self.generate_game(movie, number_of_players, intoxication_level, created_by=created_by)
+
+        # Games are chosen randomly, weighted by their rating. Games with few
+        # ratings are weighted close to pool_prior_rating, so that a single
+        # good or bad rating does not decide alone.
+        weights = [
+            max((game.rating_sum + self.pool_prior_rating * 2) / (game.rating_count + 2), 0.1)
+            for game in pool
+        ]
+        return random.choices(pool, weights=weights, k=1)[0]
+
+    def generate_games(self, movie, variants, created_by=None):
+        """Generate a game for each (number_of_players, intoxication_level, number_of_bonus_words) variant
+
+        Returns a list with either a saved Game or an ApiException for each
+        variant, in the same order as variants.
+        """
+        # Subtitles are only analysed once and the word index is shared by all
+        # games
+        words = WordIndex(self.get_words(movie))
+
+        results = []
+        for number_of_players, intoxication_level, number_of_bonus_words in variants:
+            try:
+                results.append(self.create_game(
+                    movie,
+                    words,
+                    number_of_players,
+                    intoxication_level,
+                    number_of_bonus_words,
+                    created_by=created_by
+                ))
+            except ApiException as e:
+                results.append(e)
+
+        games = [result for result in results if isinstance(result, Game)]
+
+        # All games are inserted with a single query if the database returns
+        # ids of inserted rows, otherwise they are saved in one transaction
+        features = connection.features
+        with transaction.atomic():
+            if getattr(features, 'can_return_rows_from_bulk_insert', False) or getattr(features, 'can_return_ids_from_bulk_insert', False):
+                Game.objects.bulk_create(games)
+            else:
+                for game in games:
+                    game.save()
+
+            for game in games:
+                game.serialize()
+            Game.objects.bulk_update(games, ['game_data', 'serialized'])
+
+        return results
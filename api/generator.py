@@ -1,16 +1,54 @@
-import nltk
-from nltk.tag import pos_tag
-from nltk.corpus import stopwords
-
 from .exceptions import *
-import math, random, statistics
+from collections import Counter
+import bisect, math, random, re, statistics, time
+
+class WordIndex(object):
+    """List of (word, frequency) tuples grouped by number of occurrences"""
+
+    def __init__(self, words):
+        self.buckets = {}
+        for word, frequency in words:
+            self.buckets.setdefault(frequency, []).append((word, frequency))
+
+        # Sorted list of distinct numbers of occurrences, used to find all
+        # buckets in a range
+        self.occurrences = sorted(self.buckets)
+
+    def exact(self, occurrences):
+        return self.buckets.get(occurrences, [])
+
+    def occurrences_between(self, minimum, maximum):
+        start = bisect.bisect_left(self.occurrences, minimum)
+        end = bisect.bisect_right(self.occurrences, maximum)
+        return self.occurrences[start:end]
+
+    def between(self, minimum, maximum):
+        words = []
+        for occurrences in self.occurrences_between(minimum, maximum):
+            words.extend(self.buckets[occurrences])
+        return words
 
 class DrinkingGame(object):
 
-    def __init__(self, movie, subtitles, number_of_players, intoxication_level, number_of_bonus_words=1):
+    # Maximum number of words each player can get when the multiple_words
+    # function is used and the maximum time (in seconds) spent searching for
+    # combinations of words
+    max_words_per_player = 3
+    solver_time_budget = 0.05
+
+    # Maximum number of players of one game and number of the most even
+    # solutions that multiple_words chooses from
+    max_players = 100
+    max_candidate_solutions = 50
+
+    def __init__(self, movie, words, number_of_players, intoxication_level, number_of_bonus_words=1):
         self.id = "test"
         self.movie = movie
-        self.subtitles = subtitles
+
+        # Words are chosen for each player, so the number of players is
+        # limited before any work is done
+        if number_of_players > self.max_players:
+            raise ParameterValueTooLargeException('players', self.max_players)
 
         self.number_of_players = number_of_players
         self.intoxication_level = intoxication_level
@@ -18,13 +56,16 @@ class DrinkingGame(object):
         self.words = []
         self.bonus_words = []
 
-        # Generate game based on received subtitles
-        self.generate(self.subtitles)
+        # Generate game based on the list of nouns and number of their
+        # occurrences in subtitle text (see WordFinder.get_words). When many
+        # games are generated for the same movie, the WordIndex can be built
+        # once and passed instead of the list.
+        self.generate(words if isinstance(words, WordIndex) else WordIndex(words))
     
     def repeat_words(self, words):
         # Filter the list of words and only get words that appear EXACTLY
         # intoxication_level number of times
-        players_words = list(filter(lambda x: x[1] == self.intoxication_level, words))
+        players_words = words.exact(self.intoxication_level)
 
         # If there are not words at all to choose from, raise an exception
         if len(players_words) <= 0:
@@ -49,8 +90,9 @@ class DrinkingGame(object):
         proximity = math.ceil(self.intoxication_level / 5)
 
         # Find words that have the exact number of occurences and those that do not
-        exact_occurrences = list(filter(lambda x: x[1] == self.intoxication_level, words))
-        non_exact_occurrences = list(filter(lambda x: abs(x[1] - self.intoxication_level) <= proximity and x[1] != self.intoxication_level, words))
+        exact_occurrences = words.exact(self.intoxication_level)
+        non_exact_occurrences = words.between(self.intoxication_level - proximity, self.intoxication_level - 1)
+        non_exact_occurrences.extend(words.between(self.intoxication_level + 1, self.intoxication_level + proximity))
 
         # If there are not words at all to choose from, raise an exception
         if (len(non_exact_occurrences) + len(exact_occurrences)) < self.number_of_players:
@@ -65,69 +107,126 @@ class DrinkingGame(object):
     def choose_bonus_words(self, words):
         # Rare words are words that appear at most two times. Everybody drinks
         # when this word appears.
-        rare_words = list(filter(lambda x: x[1] <= 2, words))
+        rare_words = words.between(0, 2)
         if len(rare_words) <= 0:
             return []
         
-        return random.sample(rare_words, self.number_of_bonus_words)
+        return random.sample(rare_words, min(len(rare_words), self.number_of_bonus_words))
     
-    def get_solutions(self, numbers, goal, depth, exact=False):
-        solutions = []
-
+    def get_solutions(self, numbers, goal, max_words, exact=False):
+        """Return combinations of at most max_words numbers whose sum is close to goal, most even first"""
         epsilon = 2 if not exact else 0
+        numbers = sorted(set(number for number in numbers if number > 0))
+        deadline = time.monotonic() + self.solver_time_budget
+
+        # Combinations are built layer by layer, each layer contains
+        # combinations with one more number than the previous one. Numbers in
+        # each combination are non-decreasing, so every combination is only
+        # found once, and a combination is not extended once its sum is too
+        # big or the goal can not be reached anymore.
+        solutions = []
+        layer = [(0, [], 0)]
+        for size in range(1, max_words + 1):
+            next_layer = []
+            for total, combination, start in layer:
+                for index in range(start, len(numbers)):
+                    new_value = total + numbers[index]
+                    if new_value > goal + epsilon:
+                        break
+
+                    new_combination = combination + [numbers[index]]
+                    if abs(goal - new_value) <= epsilon:
+                        solutions.append((new_value, new_combination))
+
+                    remaining_words = max_words - size
+                    if remaining_words > 0 and new_value + remaining_words * numbers[-1] >= goal - epsilon:
+                        next_layer.append((new_value, new_combination, index))
+
+                # Stop searching when the time budget is spent and use the
+                # solutions that were found so far
+                if time.monotonic() > deadline:
+                    next_layer = []
+                    break
+            layer = next_layer
 
-        possible_states = [(0, [])]
-        while len(possible_states) > 0:
-            state = possible_states.pop(0)
-            if abs(goal - state[0]) <= epsilon:
-                solutions.append(state)
-            if len(state[1]) > depth:
-                continue
-
-            for number in numbers:
-                new_value = state[0] + number
-                if state[0] - goal >= epsilon:
-                    continue
-                new_state = (new_value, state[1] + [number])
-                possible_states.append(new_state)
-            
-        return solutions
+        # Sort the solutions based on their standard deviation, because we want
+        # as even number as possible in our word occurrences.
+        return sorted(solutions, key=lambda solution: statistics.pstdev(solution[1]))
     
     def multiple_words(self, words):
         # This function will try to build
-        occurrences = set(map(lambda x: x[1], filter(lambda x: x[1] <= self.intoxication_level, words)))
+        occurrences = words.occurrences_between(0, self.intoxication_level)
 
         # Compute all possible ways to get to intoxication_level number of shots
-        # using iterative deepening algorithm with maximum number of word of 3,
-        # because drunk people can not remember more than 3 words
-        solutions = self.get_solutions(occurrences, self.intoxication_level, 1, exact=True)
-
-        # Sort the solutions based on their standard deviation, because we want
-        # as even number as possible in our word occurrences.
-        sorted_solutions = sorted(solutions, key=lambda solution: statistics.pstdev(solution[1]))
+        # with maximum number of word of 3, because drunk people can not
+        # remember more than 3 words
+        sorted_solutions = self.get_solutions(occurrences, self.intoxication_level, self.max_words_per_player, exact=True)
+
+        # Each player should get different words, so solutions that need more
+        # words with the same number of occurrences than there are, are skipped
+        sorted_solutions = [
+            solution for solution in sorted_solutions
+            if all(solution[1].count(number) <= len(words.exact(number)) for number in set(solution[1]))
+        ]
         if len(sorted_solutions) <= 0:
             raise GameGenerationException
 
+        # Only the most even solutions are considered, so that the cost of
+        # choosing words for each player does not depend on the number of
+        # solutions that were found
+        sorted_solutions = sorted_solutions[:self.max_candidate_solutions]
+
+        # Words that no other player has received yet are shuffled once for
+        # each number of occurrences and then taken from the end of the list.
+        # Words that are given again are taken from a second list that is
+        # refilled once all of them were given.
+        unused_words = {}
+        reused_words = {}
+        for solution in sorted_solutions:
+            for occurrences in solution[1]:
+                if occurrences not in unused_words:
+                    unused_words[occurrences] = random.sample(words.exact(occurrences), len(words.exact(occurrences)))
+                    reused_words[occurrences] = []
+
+        # Players only get the same words as other players when there are not
+        # enough other words, solutions that repeat the least words are used
+        def repeated_words(solution):
+            return sum(max(solution[1].count(number) - len(unused_words[number]), 0) for number in set(solution[1]))
+
         players_words = []
         for player in range(self.number_of_players):
-            selected_solutions = sorted_solutions[0:5]
-            solution = random.choices(selected_solutions, weights=range(len(selected_solutions), 0, -1), k=1)[0]
+            player_solutions, least_repeated_words = [], None
+            for solution in sorted_solutions:
+                repeated = repeated_words(solution)
+                if least_repeated_words is None or repeated < least_repeated_words:
+                    player_solutions, least_repeated_words = [solution], repeated
+                elif repeated == least_repeated_words and len(player_solutions) < 5:
+                    player_solutions.append(solution)
+
+                # Solutions are sorted, so the first five that don't repeat
+                # any words are the best ones
+                if least_repeated_words == 0 and len(player_solutions) >= 5:
+                    break
+
+            solution = random.choices(player_solutions, weights=range(len(player_solutions), 0, -1), k=1)[0]
             selected_words = []
-            for occurrences in solution[1]:
-                possible_words = list(filter(lambda x: x[1] == occurrences, words))
-                selected_words.append(random.choice(possible_words))
+            for occurrences in sorted(set(solution[1])):
+                count = solution[1].count(occurrences)
+                unused, reused = unused_words[occurrences], reused_words[occurrences]
+                selected = [unused.pop() for i in range(min(count, len(unused)))]
+                while len(selected) < count:
+                    if len(reused) <= 0:
+                        reused.extend(random.sample(words.exact(occurrences), len(words.exact(occurrences))))
+                    word = reused.pop()
+                    if word not in selected:
+                        selected.append(word)
+                selected_words.extend(selected)
+
             players_words.append(selected_words)
 
         return players_words
 
-    def generate(self, subtitles):
-        # Create a new word finder that will be used to get words that appear n
-        # times in subtitles
-        finder = WordFinder()
-
-        # Get the list of nouns and number of their occurrences in subtitle text
-        common_words = finder.get_words(self.subtitles)
-
+    def generate(self, common_words):
         # Try to use two different functions to choose words:
         #   * choose_less_or_more - will try to construct a game from words that
         #     occur similar number of times as the requested intoxication_level
@@ -138,12 +237,11 @@ class DrinkingGame(object):
         #   there is a third option available, repeat_words, which will simply
         #   repeat words and can be used instead of the choose_less_or_more
         #   function
-        """try:
+        try:
             self.words = self.choose_less_or_more(common_words)
-        except Exception as e:
+        except GameGenerationException:
             # The words could not be selected, try different function
-            self.words = self.multiple_words(common_words)"""
-        self.words = self.choose_less_or_more(common_words)
+            self.words = self.multiple_words(common_words)
         
         self.bonus_words = self.choose_bonus_words(common_words)
     
@@ -164,41 +262,104 @@ class DrinkingGame(object):
 
 class WordFinder(object):
 
+    # Word frequency tables are cached in the database, increase the version
+    # whenever the output of get_words changes so that old tables are ignored
+    VERSION = '2'
+
     def __init__(self):
+        # NLTK is only imported when it is needed, so that processes that
+        # don't analyse subtitles themselves start faster
+        from nltk.corpus import stopwords
+        from nltk.tag.perceptron import PerceptronTagger
+        from nltk.tokenize import word_tokenize
+
         # Construct a set of english stopwords that will be removed before
         # finding word frequencies
         self.stopwords = set(stopwords.words('english')) 
 
-    def to_text(self, subtitles):
-        return "\n".join([subtitle.content for subtitle in subtitles])
+        # The tagger model is loaded only once, pos_tag would load it again
+        # on every call
+        self.tagger = PerceptronTagger()
+        self.tokenize = word_tokenize
 
     def get_words(self, subtitles):
-        text = self.to_text(subtitles)
-
-        # Get words list from full subtitles text 
-        words = nltk.word_tokenize(text)
-
-        # Perform POS tagging of our words, get only NOUNS
-        tags = pos_tag(words)
-        nouns = set([word for word, tag in tags if tag.startswith('NN')])
-
-        # Remove all words shorter than 1 character and all numbers
-        words = [word for word in words if len(word) > 1]
-        words = [word for word in words if not word.isnumeric()]
-
-        # Lowercase all words and remove stopwords
-        words = [word.lower() for word in words]
-        words = [word for word in words if word not in self.stopwords]
-
-        frequency_distribution = nltk.FreqDist(words)
-        frequency_distribution = frequency_distribution.most_common(None)
-
-        possible_words = []
-        for word, frequency in frequency_distribution:
-            # Skip words that are not nouns, because it is not interesting to
-            # drink to them
-            if word not in nouns:
-                continue
+        return self.count_words(subtitle.content for subtitle in subtitles)
+
+    def count_words(self, texts):
+        """Return list of nouns and their frequencies from iterable of subtitle texts"""
+        # Subtitles are processed one by one, so memory usage does not depend
+        # on the size of subtitles file. Only the counts and the set of nouns
+        # are kept.
+        counter = Counter()
+        nouns = set()
+        for text in texts:
+            # Perform POS tagging of words in each subtitle, remember NOUNS
+            for word, tag in self.tagger.tag(self.tokenize(text)):
+                if tag.startswith('NN'):
+                    nouns.add(word)
+
+                # Skip all words shorter than 2 characters and all numbers
+                if len(word) <= 1 or word.isnumeric():
+                    continue
 
-            possible_words.append((word, frequency))
-        return possible_words
\ No newline at end of file
+                # Lowercase all words and skip stopwords
+                word = word.lower()
+                if word not in self.stopwords:
+                    counter[word] += 1
+
+        # Skip words that are not nouns, because it is not interesting to
+        # drink to them
+        return [(word, frequency) for word, frequency in counter.most_common() if word in nouns]
+
+class FastWordFinder(WordFinder):
+
+    VERSION = 'fast-1'
+
+    # Words are sequences of letters, optionally joined by apostrophes (for
+    # example "don't"). Numbers are never matched.
+    TOKEN_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+    # Part of speech of each word is only computed once per process and then
+    # reused for all following movies
+    noun_lexicon = {}
+    noun_lexicon_size = 200000
+
+    def is_noun(self, words):
+        nouns, unknown_words = {}, []
+        for word in words:
+            noun = self.noun_lexicon.get(word, None)
+            if noun is None:
+                unknown_words.append(word)
+            else:
+                nouns[word] = noun
+
+        if len(unknown_words) > 0:
+            # Tag each unknown word on its own instead of tagging every
+            # occurrence of it in the full subtitle text
+            tagged_words = [self.tagger.tag([word]) for word in unknown_words]
+            if len(self.noun_lexicon) + len(unknown_words) > self.noun_lexicon_size:
+                self.noun_lexicon.clear()
+            for [(word, tag)] in tagged_words:
+                nouns[word] = self.noun_lexicon[word] = tag.startswith('NN')
+        return nouns
+
+    def count_words(self, texts):
+        # Count lowercased words longer than one character that are not
+        # stopwords in a single pass over the subtitles
+        counter = Counter()
+        for text in texts:
+            for match in self.TOKEN_PATTERN.finditer(text):
+                word = match.group().lower()
+                if len(word) > 1 and word not in self.stopwords:
+                    counter[word] += 1
+
+        # Only the distinct words are tagged, then words that are not nouns
+        # are removed
+        nouns = self.is_noun(list(counter))
+        return [(word, frequency) for word, frequency in counter.most_common() if nouns[word]]
+
+# Word finders that can be selected with the WORD_FINDER setting
+WORD_FINDERS = {
+    'nltk': WordFinder,
+    'fast': FastWordFinder,
+}
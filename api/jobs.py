@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from .exceptions import *
+from .models import GameJob
+
+import json
+
+class GameJobRunner(object):
+
+    def __init__(self, game_service, workers=4, stale_after=600):
+        self.game_service = game_service
+
+        # Jobs are mostly waiting for TMDB and OpenSubtitles responses, so
+        # they are run in threads. Subtitle analysis itself is done by the
+        # game service analyzer.
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        # Pending jobs older than this (in seconds) were most likely lost when
+        # a web server worker was restarted
+        self.stale_after = stale_after
+
+    def get_key(self, movie_id, movie_title, number_of_players, intoxication_level):
+        if movie_id is not None:
+            movie = 'id:{}'.format(movie_id)
+        else:
+            movie = 'title:{}'.format(movie_title.strip().lower())
+        return '{}:{}:{}'.format(movie, number_of_players, intoxication_level)[:255]
+
+    def submit(self, movie_id, movie_title, number_of_players, intoxication_level, created_by=None):
+        """Return pending job for given parameters, creating and starting a new one if needed"""
+        if movie_id is None and movie_title is None:
+            raise InvalidParametersException('movie or movie_id')
+
+        key = self.get_key(movie_id, movie_title, number_of_players, intoxication_level)
+
+        # Identical request is already being processed, attach to its job
+        job = self.get_pending_job(key)
+        if job is not None:
+            return job
+
+        try:
+            job = GameJob.objects.create(
+                key=key,
+                movie_id=movie_id,
+                movie_title=movie_title,
+                number_of_players=number_of_players,
+                intoxication_level=intoxication_level,
+                created_by=created_by
+            )
+        except IntegrityError:
+            # Another request has created the same job in the meantime
+            job = self.get_pending_job(key)
+            if job is None:
+                raise ServerBusyException()
+            return job
+
+        self.executor.submit(self.run, job.id)
+        return job
+
+    def get_pending_job(self, key):
+        try:
+            job = GameJob.objects.get(key=key)
+        except GameJob.DoesNotExist:
+            return None
+
+        if self.fail_if_stale(job):
+            return None
+
+        return job
+
+    def get_job(self, job_id):
+        """Return job with given id, jobs that were lost are marked as failed"""
+        try:
+            job = GameJob.objects.get(pk=job_id)
+        except GameJob.DoesNotExist:
+            raise GameJobNotFoundException(job_id)
+
+        self.fail_if_stale(job)
+        return job
+
+    def fail_if_stale(self, job):
+        if job.status != GameJob.PENDING:
+            return False
+
+        if job.created_at is not None and job.created_at < timezone.now() - timedelta(seconds=self.stale_after):
+            self.finish(job, error=GameGenerationException('The job has timed out.'))
+            return True
+
+        return False
+
+    def finish(self, job, game=None, error=None):
+        job.key = None
+        if error is None:
+            job.status = GameJob.DONE
+            job.game = game
+        else:
+            job.status = GameJob.FAILED
+            job.error = json.dumps(error.to_dict())
+        job.save()
+
+    def run(self, job_id):
+        try:
+            job = GameJob.objects.get(id=job_id)
+            try:
+                movie = self.game_service.get_movie(movie_id=job.movie_id, movie_title=job.movie_title)
+                game = self.game_service.get_game(
+                    movie,
+                    job.number_of_players,
+                    job.intoxication_level,
+                    created_by=job.created_by
+                )
+                self.finish(job, game=game)
+            except ApiException as e:
+                self.finish(job, error=e)
+            except Exception as e:
+                print('Game job {} has failed: {}'.format(job_id, e))
+                self.finish(job, error=GameGenerationException())
+        finally:
+            # Each thread has its own database connection, which must be
+            # closed by the thread itself
+            close_old_connections()
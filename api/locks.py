@@ -0,0 +1,49 @@
+import fcntl
+import os
+import re
+import tempfile
+import time
+
+from .exceptions import ServerBusyException
+
+class FileLock(object):
+    """Exclusive lock that works across threads and web server processes"""
+
+    def __init__(self, name, directory=None, timeout=120, poll_interval=0.1):
+        directory = directory if directory is not None else os.path.join(tempfile.gettempdir(), 'movie_shots_locks')
+        os.makedirs(directory, exist_ok=True)
+
+        # Only use safe characters in lock file names
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+        self.path = os.path.join(directory, '{}.lock'.format(name))
+
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self.file.close()
+                    self.file = None
+                    raise ServerBusyException()
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
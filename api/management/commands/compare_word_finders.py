@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from api.generator import WORD_FINDERS
+
+import srt
+import time
+
+class Command(BaseCommand):
+    help = 'Compare speed and found nouns of a word finder against the default NLTK word finder'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Paths to .srt subtitle files')
+        parser.add_argument('--word-finder', default='fast', choices=[name for name in WORD_FINDERS if name != 'nltk'])
+
+    def run(self, word_finder, subtitles):
+        start = time.perf_counter()
+        words = word_finder.get_words(subtitles)
+        return dict(words), time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        reference_finder = WORD_FINDERS['nltk']()
+        word_finder = WORD_FINDERS[options['word_finder']]()
+
+        total_reference_time, total_time = 0, 0
+        for path in options['files']:
+            with open(path, 'r', encoding='utf-8', errors='replace') as subtitle_file:
+                subtitles = list(srt.parse(subtitle_file.read()))
+
+            reference_words, reference_time = self.run(reference_finder, subtitles)
+            words, duration = self.run(word_finder, subtitles)
+            total_reference_time += reference_time
+            total_time += duration
+
+            # Precision and recall of found nouns, where the NLTK word finder
+            # is used as ground truth. The weighted recall counts each word
+            # by its number of occurrences, so frequent words matter more.
+            common_words = set(words) & set(reference_words)
+            precision = len(common_words) / len(words) if len(words) > 0 else 0
+            recall = len(common_words) / len(reference_words) if len(reference_words) > 0 else 0
+
+            reference_occurrences = sum(reference_words.values())
+            weighted_recall = sum(reference_words[word] for word in common_words) / reference_occurrences if reference_occurrences > 0 else 0
+
+            # Words found by both finders should also have the same counts
+            equal_counts = sum(1 for word in common_words if words[word] == reference_words[word])
+            count_agreement = equal_counts / len(common_words) if len(common_words) > 0 else 0
+
+            self.stdout.write('{}: precision {:.3f}, recall {:.3f}, weighted recall {:.3f}, equal counts {:.3f}, time {:.3f}s vs {:.3f}s'.format(
+                path, precision, recall, weighted_recall, count_agreement, duration, reference_time
+            ))
+
+        speedup = total_reference_time / total_time if total_time > 0 else 0
+        self.stdout.write(self.style.SUCCESS('Total time {:.3f}s vs {:.3f}s ({:.1f}x faster)'.format(
+            total_time, total_reference_time, speedup
+        )))
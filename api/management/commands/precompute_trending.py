@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from api.exceptions import ApiException
+from api.models import Game
+from api.services import create_subtitle_service, create_subtitle_analyzer, create_game_service
+
+import tmdbsimple as tmdb
+
+def parse_numbers(value):
+    return [int(number) for number in value.split(',') if number.strip()]
+
+class Command(BaseCommand):
+    help = 'Download subtitles, compute word frequencies and generate games for trending movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=getattr(settings, 'PRECOMPUTE_TRENDING_PAGES', 1))
+        parser.add_argument(
+            '--players',
+            type=parse_numbers,
+            default=getattr(settings, 'PRECOMPUTE_NUMBER_OF_PLAYERS', [2, 3, 4, 5]),
+            help='Comma separated list of number of players, for example 2,3,4'
+        )
+        parser.add_argument(
+            '--intoxication',
+            type=parse_numbers,
+            default=getattr(settings, 'PRECOMPUTE_INTOXICATION_LEVELS', [4, 8, 12]),
+            help='Comma separated list of intoxication levels, for example 4,8,12'
+        )
+
+    def handle(self, *args, **options):
+        # Services are configured like in the web server, so that movies are
+        # locked in the same lock directory while their subtitles are
+        # downloaded. Subtitles are analysed in this process.
+        subtitle_service = create_subtitle_service()
+        game_service = create_game_service(subtitle_service, create_subtitle_analyzer(workers=0))
+
+        generated_games = 0
+        for page in range(1, options['pages'] + 1):
+            trending = tmdb.Trending(media_type='movie', time_window='week')
+            results = trending.info(page=page)
+
+            for result in results['results']:
+                try:
+                    # Movie information from trending results does not contain
+                    # all fields (for example runtime), so it is read from the
+                    # local database or downloaded again
+                    movie = game_service.get_movie(movie_id=str(result['id']))
+
+                    # Download subtitles and compute word frequencies once, all
+                    # games below are then generated from the cached table
+                    game_service.get_words(movie)
+                except Exception as e:
+                    self.stderr.write('Movie {} could not be processed: {}'.format(result.get('id'), e))
+                    continue
+
+                for number_of_players in options['players']:
+                    for intoxication_level in options['intoxication']:
+                        exists = Game.objects.filter(
+                            movie=movie,
+                            number_of_players=number_of_players,
+                            intoxication_level=intoxication_level
+                        ).exists()
+                        if exists:
+                            continue
+
+                        try:
+                            game_service.generate_game(movie, number_of_players, intoxication_level)
+                            generated_games += 1
+                        except ApiException as e:
+                            # There might not be enough words for some
+                            # combinations of parameters, skip them
+                            self.stderr.write('{} ({} players, {} shots): {}'.format(movie, number_of_players, intoxication_level, e.message))
+
+                self.stdout.write('Processed {}'.format(movie))
+
+        self.stdout.write(self.style.SUCCESS('Generated {} games'.format(generated_games)))
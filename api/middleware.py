@@ -1,14 +1,37 @@
 from .models import User
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
 from django.http import JsonResponse
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 from .exceptions import ApiException, NoApiKeyException
+from .cache import MemoryCacheBackend
 
 class ApiKeyMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
 
+        # Ids of users that have recently made a request, by their API key
+        self.users = MemoryCacheBackend(getattr(settings, 'API_KEY_CACHE_SIZE', 10000))
+        self.timeout = getattr(settings, 'API_KEY_CACHE_TIMEOUT', 60 * 60)
+
+    def get_user(self, api_key):
+        # If the user has been seen recently, construct the User object from
+        # the cached id without querying the database. Other fields are loaded
+        # from the database if they are needed.
+        user_id = self.users.get(api_key)
+        if user_id is not None:
+            return User.from_db(DEFAULT_DB_ALIAS, ['id', 'api_key'], [user_id, api_key])
+
+        # If there already exists user with api key matching the received one,
+        # return it, otherwise create a new user. The API key is unique, so
+        # concurrent requests can not create the same user twice.
+        user, _ = User.objects.get_or_create(api_key=api_key)
+        self.users.set(api_key, user.id, self.timeout)
+        return user
+
     def __call__(self, request):
         if request.path.startswith(reverse('admin:index')):
             return self.get_response(request)
@@ -23,17 +46,10 @@ class ApiKeyMiddleware:
         if not api_key:
             return JsonResponse(NoApiKeyException().to_dict())
         else:
-            # The API key is present, if there already exists user with api key
-            # matching the received one, return it, otherwise create a new user
-            try:
-                # The user has been found, add it to request
-                request.api_user = User.objects.get(api_key=api_key)
-            except User.DoesNotExist:
-                # The user does not exist, create a new user with received api
-                # key and return it
-                new_user = User(api_key=api_key)
-                new_user.save()
-                request.api_user = new_user
+            # The API key is present, add its user to request. Most endpoints
+            # never use it, so the user is only found or created when a view
+            # accesses it.
+            request.api_user = SimpleLazyObject(lambda: self.get_user(api_key))
 
         response = self.get_response(request)
         return response
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_auto_20200723_1545'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='subtitles_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.CreateModel(
+            name='WordFrequencies',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtitles_hash', models.CharField(max_length=64)),
+                ('tokenizer_version', models.CharField(max_length=32)),
+                ('words', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='word_frequencies', to='api.Movie')),
+            ],
+            options={
+                'unique_together': {('movie', 'subtitles_hash', 'tokenizer_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_word_frequencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('key', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('movie_id', models.CharField(blank=True, max_length=160, null=True)),
+                ('movie_title', models.CharField(blank=True, max_length=240, null=True)),
+                ('number_of_players', models.IntegerField()),
+                ('intoxication_level', models.IntegerField()),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.User')),
+                ('game', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.Game')),
+            ],
+        ),
+    ]
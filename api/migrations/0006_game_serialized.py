@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_gamejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='serialized',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_users(apps, schema_editor):
+    # Users used to be created with a non-atomic get-then-save, so concurrent
+    # requests could create several users with the same API key. Keep the
+    # oldest one and move everything else to it.
+    User = apps.get_model('api', 'User')
+    Game = apps.get_model('api', 'Game')
+    GameJob = apps.get_model('api', 'GameJob')
+    Rating = apps.get_model('api', 'Rating')
+
+    duplicates = User.objects.values('api_key').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        user_ids = list(User.objects.filter(api_key=duplicate['api_key']).order_by('id').values_list('id', flat=True))
+        user_id, duplicate_ids = user_ids[0], user_ids[1:]
+
+        Rating.objects.filter(user_id__in=duplicate_ids).update(user_id=user_id)
+        Game.objects.filter(created_by_id__in=duplicate_ids).update(created_by_id=user_id)
+        GameJob.objects.filter(created_by_id__in=duplicate_ids).update(created_by_id=user_id)
+        User.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_game_serialized'),
+    ]
+
+    # The unique constraint is added in a separate migration, PostgreSQL
+    # can not alter a table with pending trigger events in the same
+    # transaction
+    operations = [
+        migrations.RunPython(merge_duplicate_users, migrations.RunPython.noop),
+    ]
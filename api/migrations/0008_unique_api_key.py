@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_deduplicate_users'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='api_key',
+            field=models.CharField(max_length=160, unique=True),
+        ),
+    ]
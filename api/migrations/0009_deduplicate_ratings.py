@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    # Users could rate the same game more than once, only keep their latest
+    # rating
+    Rating = apps.get_model('api', 'Rating')
+
+    duplicates = Rating.objects.values('user', 'game').annotate(count=Count('id'), latest=Max('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Rating.objects.filter(user=duplicate['user'], game=duplicate['game']).exclude(id=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_unique_api_key'),
+    ]
+
+    # The unique constraint is added in a separate migration, PostgreSQL
+    # can not alter a table with pending trigger events in the same
+    # transaction
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_deduplicate_ratings'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='rating',
+            unique_together={('user', 'game')},
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def compute_rating_aggregates(apps, schema_editor):
+    Game = apps.get_model('api', 'Game')
+    Movie = apps.get_model('api', 'Movie')
+    Rating = apps.get_model('api', 'Rating')
+
+    movies = {}
+    for aggregate in Rating.objects.values('game_id', 'game__movie_id').annotate(count=Count('id'), total=Sum('rating')):
+        Game.objects.filter(id=aggregate['game_id']).update(
+            rating_count=aggregate['count'],
+            rating_sum=aggregate['total'],
+            rating_average=aggregate['total'] / aggregate['count']
+        )
+        count, total = movies.get(aggregate['game__movie_id'], (0, 0))
+        movies[aggregate['game__movie_id']] = (count + aggregate['count'], total + aggregate['total'])
+
+    for movie_id, (count, total) in movies.items():
+        Movie.objects.filter(id=movie_id).update(rating_count=count, rating_sum=total, rating_average=total / count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_unique_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='rating_average',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_average',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['movie', '-rating_average', '-rating_count'], name='game_movie_rating_idx'),
+        ),
+        migrations.RunPython(compute_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import json
+
+
+def extract_imdb_ids(apps, schema_editor):
+    # Movies that were downloaded from TMDB movie information endpoint have
+    # their IMDB id saved in additional data
+    Movie = apps.get_model('api', 'Movie')
+    for movie in Movie.objects.filter(imdb_id__isnull=True).exclude(additional_data__isnull=True).iterator():
+        try:
+            imdb_id = json.loads(movie.additional_data).get('imdb_id', None)
+        except (ValueError, AttributeError):
+            continue
+        if imdb_id:
+            Movie.objects.filter(id=movie.id).update(imdb_id=imdb_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_game_parameters_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='imdb_id',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.RunPython(extract_imdb_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_movie_imdb_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='subtitles_format',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,12 +1,13 @@
 from django.db import models
 from datetime import datetime
+import hashlib
 import json
 
 class User(models.Model):
     # Users are only identified with an API key that is generated on device as a
     # random UUID. This ensures that each app installation can only vote once
     # per game, though it is possible to clear app data and reset this key.
-    api_key = models.CharField(max_length=160)
+    api_key = models.CharField(max_length=160, unique=True)
     ratings = models.ManyToManyField('Game', through='Rating')
 
     created_at = models.DateTimeField(auto_now_add=True, null=True)
@@ -27,17 +28,114 @@ class Movie(models.Model):
     release_date = models.DateField(blank=True, null=True)
     cover = models.TextField(blank=True, null=True)
 
-    # Each movie also has a subtitle file from which games are generated. The
-    # srt file is saved on disk and has encoding "utf-8"
+    # IMDB id (for example "tt0111161") that is needed to find subtitles. It is
+    # stored so that TMDB doesn't need to be queried again for it.
+    imdb_id = models.CharField(max_length=16, blank=True, null=True)
+
+    # Each movie also has a subtitle file from which games are generated. Old
+    # subtitles are "utf-8" encoded srt files, new ones are saved in compact
+    # format (see subtitle_store) and subtitles_format is its version.
+    SRT_FORMAT = 0
     subtitles_file = models.FileField(upload_to='subtitles/', blank=True, null=True)
+    subtitles_format = models.IntegerField(default=SRT_FORMAT)
+
+    # Hash of the subtitles file content. It is used as a key for the cached
+    # word frequency tables, so that changing the subtitles file automatically
+    # invalidates them.
+    subtitles_hash = models.CharField(max_length=64, blank=True, null=True)
     
     # In order not to overload TMDB movie API, with each movie, we also save
     # (cache) additional movie information that is currently not needed but
     # might be in the future.
     additional_data = models.TextField(blank=True, null=True)
 
+    # Number, sum and average of ratings of all games for this movie. They are
+    # updated whenever new ratings are saved (see RatingBuffer).
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    rating_average = models.FloatField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Remember which subtitles file the movie was loaded with, so that we
+        # can detect when it changes
+        self._original_subtitles_file = self.subtitles_file.name
+
+    def save(self, *args, **kwargs):
+        subtitles_changed = self.subtitles_file.name != self._original_subtitles_file
+        if subtitles_changed:
+            self.subtitles_hash = self.compute_subtitles_hash()
+
+        # Rating aggregates are only changed with UPDATE queries when ratings
+        # are saved, so saving a movie that was loaded earlier must not
+        # overwrite them with old values
+        if not self._state.adding and kwargs.get('update_fields', None) is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('rating_count', 'rating_sum', 'rating_average')
+            ]
+
+        super().save(*args, **kwargs)
+
+        # Word frequencies that were computed from previous subtitles are no
+        # longer valid, remove them
+        if subtitles_changed:
+            self.word_frequencies.exclude(subtitles_hash=self.subtitles_hash).delete()
+            self._original_subtitles_file = self.subtitles_file.name
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._original_subtitles_file = self.subtitles_file.name
+
+    def compute_subtitles_hash(self):
+        if not self.subtitles_file:
+            return None
+
+        try:
+            digest = hashlib.sha256()
+            with self.subtitles_file.open('rb') as subtitles_file:
+                for chunk in subtitles_file.chunks():
+                    digest.update(chunk)
+            return digest.hexdigest()
+        except Exception as e:
+            print('Subtitles hash for {} could not be computed: {}'.format(self, e))
+            return None
+
+    def get_word_frequencies(self, tokenizer_version):
+        """Return cached list of (word, frequency) tuples or None if they have not been computed yet"""
+        # Movies whose subtitles were saved before hashes were introduced are
+        # hashed lazily
+        if self.subtitles_file and not self.subtitles_hash:
+            self.subtitles_hash = self.compute_subtitles_hash()
+            if self.subtitles_hash is None:
+                return None
+            Movie.objects.filter(pk=self.pk).update(subtitles_hash=self.subtitles_hash)
+
+        if not self.subtitles_hash:
+            return None
+
+        try:
+            word_frequencies = self.word_frequencies.get(
+                subtitles_hash=self.subtitles_hash,
+                tokenizer_version=tokenizer_version
+            )
+            return word_frequencies.to_list()
+        except WordFrequencies.DoesNotExist:
+            return None
+
+    def save_word_frequencies(self, tokenizer_version, words):
+        if not self.subtitles_hash:
+            return
+
+        WordFrequencies.objects.update_or_create(
+            movie=self,
+            subtitles_hash=self.subtitles_hash,
+            tokenizer_version=tokenizer_version,
+            defaults={'words': json.dumps(words)}
+        )
     
     def update_release_date(self, release_date):
         try:
@@ -67,6 +165,9 @@ class Movie(models.Model):
 
         if 'runtime' in response and response['runtime'] is not None:
             self.duration = response['runtime']
+
+        if 'imdb_id' in response and response['imdb_id']:
+            self.imdb_id = response['imdb_id']
     
     def year(self):
         if self.release_date is None:
@@ -93,6 +194,31 @@ class Movie(models.Model):
     def __str__(self):
         return '[{}] {}'.format(self.id, self.title)
 
+class WordFrequencies(models.Model):
+    # Noun frequency table computed from movie subtitles. Part of speech
+    # tagging is the slowest part of game generation, so the result is stored
+    # and reused for every following game for the same movie. The table is
+    # only valid for the subtitles file and tokenizer version it was computed
+    # with.
+    movie = models.ForeignKey(Movie, related_name='word_frequencies', on_delete=models.CASCADE)
+    subtitles_hash = models.CharField(max_length=64)
+    tokenizer_version = models.CharField(max_length=32)
+
+    # JSON encoded list of [word, frequency] pairs, ordered by frequency
+    words = models.TextField()
+
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('movie', 'subtitles_hash', 'tokenizer_version')
+
+    def to_list(self):
+        return [(word, frequency) for word, frequency in json.loads(self.words)]
+
+    def __str__(self):
+        return 'Word frequencies for {} ({})'.format(self.movie_id, self.tokenizer_version)
+
 class Game(models.Model):
     # Game information such as how many players are playing this game and how
     # many shots each one should drink.
@@ -101,18 +227,94 @@ class Game(models.Model):
     number_of_bonus_words = models.IntegerField()
     
     game_data = models.TextField()
+
+    # Whether game_data already contains the game id and can be served as is,
+    # without parsing it. Games created before this field was introduced are
+    # converted when they are first requested.
+    serialized = models.BooleanField(default=False)
     
     created_by = models.ForeignKey(User, related_name='creator', blank=True, null=True, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
 
     ratings = models.ManyToManyField(User, through='Rating')
 
+    # Number, sum and average of ratings of this game, so that games can be
+    # ordered by their rating without aggregating the ratings table
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    rating_average = models.FloatField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', '-rating_average', '-rating_count'], name='game_movie_rating_idx'),
+            models.Index(fields=['movie', 'number_of_players', 'intoxication_level'], name='game_movie_parameters_idx'),
+        ]
+
+    def to_dict(self):
+        game_json = json.loads(self.game_data)
+        game_json['id'] = str(self.id)
+        return game_json
+
+    def serialize(self):
+        """Include game id in game_data, the game must already be saved"""
+        self.game_data = json.dumps(self.to_dict())
+        self.serialized = True
+
     def __str__(self):
         return 'Game {}'.format(self.id)
 
+class GameJob(models.Model):
+    # Games can also be generated in the background. The client receives the
+    # job id immediately and then polls until the job is either done or has
+    # failed.
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    # While the job is pending, the key describes the requested movie and game
+    # parameters. It is unique, so identical requests attach to the same job
+    # instead of generating the same game twice. Once the job is finished, the
+    # key is cleared.
+    key = models.CharField(max_length=255, unique=True, blank=True, null=True)
+
+    movie_id = models.CharField(max_length=160, blank=True, null=True)
+    movie_title = models.CharField(max_length=240, blank=True, null=True)
+    number_of_players = models.IntegerField()
+    intoxication_level = models.IntegerField()
+
+    created_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.CASCADE)
+    game = models.ForeignKey('Game', blank=True, null=True, on_delete=models.SET_NULL)
+
+    # JSON encoded ApiException dictionary if the job has failed
+    error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def to_dict(self):
+        job = {
+            "id": str(self.id),
+            "status": self.status
+        }
+        if self.status == GameJob.DONE and self.game_id is not None:
+            job['game'] = str(self.game_id)
+        if self.status == GameJob.FAILED and self.error:
+            job['error'] = json.loads(self.error)
+        return job
+
+    def __str__(self):
+        return 'Job {} ({})'.format(self.id, self.status)
+
 class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
@@ -121,5 +323,9 @@ class Rating(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Each user can only rate each game once, new ratings replace old ones
+        unique_together = ('user', 'game')
+
     def __str__(self):
         return 'Rating {}'.format(self.id)
\ No newline at end of file
@@ -0,0 +1,204 @@
+from django.db import close_old_connections, transaction
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.utils import timezone
+
+from .models import Game, Movie, Rating
+
+from collections import defaultdict
+import atexit
+import math
+import threading
+
+def update_rating_aggregates(model, changes):
+    """Add (count, sum) changes by object id to rating aggregates of model"""
+    for object_id, (count, total) in changes.items():
+        model.objects.filter(id=object_id).update(
+            rating_count=F('rating_count') + count,
+            rating_sum=F('rating_sum') + total
+        )
+
+    # Averages are computed from the updated values in a separate query,
+    # because some databases use updated values in the same UPDATE statement
+    # and others don't
+    model.objects.filter(id__in=list(changes), rating_count__gt=0).update(
+        rating_average=ExpressionWrapper(F('rating_sum') / F('rating_count'), output_field=FloatField())
+    )
+
+class RatingBuffer(object):
+    """Collects game ratings in memory and saves them to database in batches"""
+
+    def __init__(self, flush_size=100, max_size=10000, flush_interval=5, max_attempts=5):
+        # Ratings that are waiting to be saved, by (user id, game id). When a
+        # user rates the same game again before the ratings are saved, only
+        # the last rating is kept.
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+        # Ratings are saved by a background thread every flush_interval
+        # seconds or as soon as there are flush_size pending ratings. If there
+        # are more than max_size pending ratings, new ones are dropped.
+        self.flush_size = flush_size
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        # Ratings that could not be saved are retried with the next flush,
+        # but at most max_attempts times
+        self.max_attempts = max_attempts
+        self.attempts = {}
+
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        # Save pending ratings when the web server process is stopped
+        atexit.register(self.flush)
+
+    def add(self, user_id, game_id, rating):
+        if not math.isfinite(rating):
+            return False
+
+        with self.lock:
+            key = (user_id, game_id)
+            if key not in self.pending and len(self.pending) >= self.max_size:
+                self.dropped += 1
+                return False
+
+            self.pending[key] = rating
+            self.attempts.pop(key, None)
+            self.queued += 1
+            pending = len(self.pending)
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+        if pending >= self.flush_size:
+            self.wakeup.set()
+        return True
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print('Ratings could not be saved: {}'.format(e))
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Save all pending ratings and return the number of saved ratings"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+
+            if len(pending) <= 0:
+                return 0
+
+            failed = {}
+            try:
+                saved = self.save(pending)
+            except Exception as e:
+                # A single rating that can not be saved makes the whole batch
+                # fail, so ratings are saved one by one to find it
+                print('Ratings could not be saved in a batch: {}'.format(e))
+                saved = 0
+                for key, rating in pending.items():
+                    try:
+                        saved += self.save({key: rating})
+                    except Exception:
+                        failed[key] = rating
+
+            with self.lock:
+                for key in pending:
+                    if key not in failed:
+                        self.attempts.pop(key, None)
+                self.flushed += saved
+                self.dropped += len(pending) - saved - len(failed)
+                self.retry(failed)
+            return saved
+
+    def retry(self, failed):
+        # Return ratings to the buffer so that they are saved with the next
+        # flush, unless the user has rated the game again. Ratings that keep
+        # failing are dropped.
+        for key, rating in failed.items():
+            if key in self.pending:
+                continue
+
+            attempts = self.attempts.pop(key, 0) + 1
+            if attempts >= self.max_attempts:
+                print('Rating {} of game {} could not be saved, dropping it'.format(rating, key[1]))
+                self.failed += 1
+                continue
+            if len(self.pending) >= self.max_size:
+                self.dropped += 1
+                continue
+
+            self.pending[key] = rating
+            self.attempts[key] = attempts
+
+    def save(self, pending):
+        # Ratings of games that do not exist are dropped
+        games = dict(Game.objects.filter(id__in=set(game_id for _, game_id in pending)).values_list('id', 'movie_id'))
+        pending = {key: rating for key, rating in pending.items() if key[1] in games}
+        if len(pending) <= 0:
+            return 0
+
+        with transaction.atomic():
+            # Each user can only rate a game once, existing ratings are
+            # updated and the other ones are created
+            existing_ratings = Rating.objects.select_for_update().filter(
+                user_id__in=set(user_id for user_id, _ in pending),
+                game_id__in=set(game_id for _, game_id in pending)
+            )
+            existing_ratings = {(rating.user_id, rating.game_id): rating for rating in existing_ratings}
+
+            # Changes of number and sum of ratings for each game, new ratings
+            # add to both and changed ratings only change the sum
+            game_changes = defaultdict(lambda: [0, 0.0])
+
+            now = timezone.now()
+            updated_ratings, new_ratings = [], []
+            for (user_id, game_id), value in pending.items():
+                rating = existing_ratings.get((user_id, game_id), None)
+                if rating is None:
+                    new_ratings.append(Rating(user_id=user_id, game_id=game_id, rating=value))
+                    game_changes[game_id][0] += 1
+                    game_changes[game_id][1] += value
+                else:
+                    game_changes[game_id][1] += value - rating.rating
+                    rating.rating = value
+                    rating.updated_at = now
+                    updated_ratings.append(rating)
+
+            # If another process has created one of the new ratings in the
+            # meantime, the transaction fails and the ratings are saved with
+            # the next flush
+            Rating.objects.bulk_update(updated_ratings, ['rating', 'updated_at'])
+            Rating.objects.bulk_create(new_ratings)
+
+            movie_changes = defaultdict(lambda: [0, 0.0])
+            for game_id, (count, total) in game_changes.items():
+                movie_changes[games[game_id]][0] += count
+                movie_changes[games[game_id]][1] += total
+
+            update_rating_aggregates(Game, game_changes)
+            update_rating_aggregates(Movie, movie_changes)
+
+        return len(pending)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queued,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": len(self.pending)
+            }
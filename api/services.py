@@ -0,0 +1,69 @@
+from django.conf import settings
+
+from .subtitle_service import SubtitleService
+from .cache import ResponseCache, MemoryCacheBackend, DjangoCacheBackend
+from .game_service import GameService
+from .analyzer import SubtitleAnalyzer
+
+# Services are configured from Django settings in one place, so that web
+# server workers and management commands use the same configuration (and the
+# same lock directory for subtitle downloads)
+
+def create_response_cache():
+    # TMDB responses are cached either in this process or in Django cache that
+    # can be shared between processes
+    if getattr(settings, 'TMDB_CACHE_BACKEND', 'memory') == 'django':
+        backend = DjangoCacheBackend(getattr(settings, 'TMDB_CACHE_ALIAS', 'default'))
+    else:
+        backend = MemoryCacheBackend(getattr(settings, 'TMDB_CACHE_SIZE', 1024))
+
+    return ResponseCache(
+        backend=backend,
+        ttl=getattr(settings, 'TMDB_CACHE_TTL', {'search': 60 * 60, 'movie': 24 * 60 * 60, 'trending': 60 * 60}),
+        stale_ttl=getattr(settings, 'TMDB_CACHE_STALE_TTL', {'trending': 24 * 60 * 60})
+    )
+
+def create_subtitle_service(cache=None):
+    # TMDB configuration and OpenSubtitles login are only fetched when they
+    # are first needed
+    return SubtitleService(
+        tmdb_api_key=settings.TMDB_API_KEY,
+        opensubtitles_username=settings.OPENSUBTITLES_USERNAME,
+        opensubtitles_password=settings.OPENSUBTITLES_PASSWORD,
+        cache=cache,
+        configuration_file=getattr(settings, 'TMDB_CONFIGURATION_FILE', None),
+        configuration_refresh_interval=getattr(settings, 'TMDB_CONFIGURATION_REFRESH_INTERVAL', 7 * 24 * 60 * 60),
+        token_lifetime=getattr(settings, 'OPENSUBTITLES_TOKEN_LIFETIME', 10 * 60),
+        candidates=getattr(settings, 'SUBTITLE_CANDIDATES', 3),
+        download_timeout=getattr(settings, 'SUBTITLE_DOWNLOAD_TIMEOUT', 10),
+        min_cues=getattr(settings, 'SUBTITLE_MIN_CUES', 50),
+        duration_tolerance=getattr(settings, 'SUBTITLE_DURATION_TOLERANCE', 0.15),
+        max_size=getattr(settings, 'SUBTITLE_MAX_SIZE', 10 * 1024 * 1024),
+        tmdb_timeout=getattr(settings, 'TMDB_TIMEOUT', 10)
+    )
+
+def create_subtitle_analyzer(workers=None):
+    # Subtitles are analysed in a pool of worker processes, so that the CPU
+    # heavy part of speech tagging does not block other requests. The number
+    # of workers can be configured separately from the number of web server
+    # threads, 0 analyses subtitles inline.
+    return SubtitleAnalyzer(
+        workers=workers if workers is not None else getattr(settings, 'NLP_WORKERS', 2),
+        queue_size=getattr(settings, 'NLP_QUEUE_SIZE', 4),
+        timeout=getattr(settings, 'NLP_TIMEOUT', 60),
+        word_finder=getattr(settings, 'WORD_FINDER', 'nltk')
+    )
+
+def create_game_service(subtitle_service, analyzer):
+    return GameService(
+        subtitle_service,
+        analyzer,
+        lock_directory=getattr(settings, 'LOCK_DIRECTORY', None),
+        lock_timeout=getattr(settings, 'LOCK_TIMEOUT', 120),
+        pool_size=getattr(settings, 'GAME_POOL_SIZE', 0),
+        pool_prior_rating=getattr(settings, 'GAME_POOL_PRIOR_RATING', 2.5),
+        compress_subtitles=getattr(settings, 'SUBTITLES_COMPRESS', False),
+        max_players=getattr(settings, 'GAME_MAX_PLAYERS', 20),
+        max_intoxication_level=getattr(settings, 'GAME_MAX_INTOXICATION', 100),
+        max_bonus_words=getattr(settings, 'GAME_MAX_BONUS_WORDS', 10)
+    )
@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+# Durations (in seconds) of expensive initialization steps in this process.
+# Some of them (like the first TMDB configuration download) only happen when
+# they are first needed. The report is written to stderr, so that it does not
+# mix with output of management commands.
+timings = {}
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        print('[startup] {} took {:.3f}s (pid {})'.format(name, timings[name], os.getpid()), file=sys.stderr)
+
+def report():
+    total = sum(timings.values())
+    steps = ', '.join('{} {:.3f}s'.format(name, duration) for name, duration in timings.items())
+    print('[startup] process {} initialized in {:.3f}s ({})'.format(os.getpid(), total, steps), file=sys.stderr)
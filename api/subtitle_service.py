@@ -2,31 +2,204 @@
 from pythonopensubtitles.opensubtitles import OpenSubtitles
 import tmdbsimple as tmdb
 
-import urllib.request
+import requests
 import srt
-import gzip, io
+import codecs, re, zlib
+import json, os, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from contextlib import nullcontext
+
+from django.db import connection
 
 from .exceptions import *
-from .models import Movie
+from .models import Movie, Game
+from .cache import ResponseCache
+from .startup import timed
+
+try:
+    from charset_normalizer import from_path
+except ImportError:
+    from_path = None
+
+# Image configuration that is used if TMDB configuration can not be downloaded
+# and there is no saved copy, see
+# https://developers.themoviedb.org/3/configuration/get-api-configuration
+DEFAULT_CONFIGURATION = {
+    'images': {
+        'secure_base_url': 'https://image.tmdb.org/t/p/',
+        'poster_sizes': ['w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original']
+    }
+}
+
+TIMESTAMP_PATTERN = re.compile(r'\s*\d+:\d+:\d+[,.:]?\d*\s*-->')
+
+def detect_encoding(path):
+    # Most subtitles that are not "utf-8" encoded are in one of the Windows
+    # code pages, which is also used when the encoding can not be detected
+    if from_path is not None:
+        matches = from_path(path)
+        best = matches.best()
+        if best is not None:
+            # Short texts often fit several code pages equally well, the
+            # western one is chosen for english subtitles
+            for match in matches:
+                if match.chaos == best.chaos and match.coherence == best.coherence and 'cp1252' in match.could_be_from_charset:
+                    return 'cp1252'
+            return best.encoding
+    return 'cp1252'
+
+def parse_subtitles_file(path):
+    """Parse "utf-8" encoded .srt file one cue at a time without reading the whole file"""
+    with open(path, 'r', encoding='utf-8-sig') as subtitle_file:
+        # Cue text may contain empty lines, so a new cue only starts with an
+        # index line after an empty line that is followed by the timestamps
+        block = []
+        for line in subtitle_file:
+            if TIMESTAMP_PATTERN.match(line) and len(block) >= 2 and block[-1].strip().isdigit() and not block[-2].strip():
+                yield from srt.parse(''.join(block[:-1]))
+                block = block[-1:]
+            block.append(line)
+        if block:
+            yield from srt.parse(''.join(block))
+
+def remove_candidate(future, keep):
+    if future.cancelled() or future.exception() is not None:
+        return
+    path, score = future.result()
+    if score is not None and path != keep:
+        os.remove(path)
 
 class SubtitleService(object):
+
+    # Number of stored games that are returned with each trending movie
+    games_per_movie = 4
     
-    def __init__(self, tmdb_api_key='', opensubtitles_username='', opensubtitles_password=''):
-        # Configure the movie database client with our api key
+    def __init__(self, tmdb_api_key='', opensubtitles_username='', opensubtitles_password='', cache=None,
+                 configuration_file=None, configuration_refresh_interval=7 * 24 * 60 * 60, token_lifetime=10 * 60,
+                 candidates=3, download_timeout=10, min_cues=50, duration_tolerance=0.15, max_size=10 * 1024 * 1024,
+                 tmdb_timeout=10):
+        # Configure the movie database client with our api key. Requests
+        # don't have a timeout by default.
         tmdb.API_KEY = tmdb_api_key
+        tmdb.REQUESTS_TIMEOUT = tmdb_timeout
 
-        # To get images, we must construct the URL from the configuration
-        self.configuration = tmdb.Configuration().info()
+        # TMDB responses are cached, so that repeated searches and movie
+        # information requests don't need a network round trip
+        self.cache = cache if cache is not None else ResponseCache()
 
-        # Import the open subtitles client and login to get the token
+        # To get images, we must construct the URL from the configuration. It
+        # rarely changes, so it is saved to a file and only downloaded again
+        # after configuration_refresh_interval seconds (see configuration).
+        self.configuration_file = configuration_file if configuration_file is not None else os.path.join(tempfile.gettempdir(), 'movie_shots_tmdb_configuration.json')
+        self.configuration_refresh_interval = configuration_refresh_interval
+        self.configuration_loaded_at = None
+        self._configuration = None
+        self.configuration_lock = threading.Lock()
+
+        # Open subtitles client only logs in when subtitles are first needed
+        # and logs in again after the token expires (see login)
         self.opensubtitles = OpenSubtitles()
-        self.token = self.opensubtitles.login(opensubtitles_username, opensubtitles_password)
-        assert self.token is not None
+        self.opensubtitles_username = opensubtitles_username
+        self.opensubtitles_password = opensubtitles_password
+        self.token = None
+        self.token_lifetime = token_lifetime
+        self.token_expires_at = 0
+        self.login_lock = threading.Lock()
+
+        # The most downloaded candidates are downloaded at the same time over
+        # pooled connections, each request must finish in download_timeout
+        # seconds
+        self.candidates = max(candidates, 1)
+        self.download_timeout = download_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.candidates)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Downloads with more decompressed bytes than this are rejected
+        self.max_size = max_size
+
+        # Subtitles with fewer cues are rejected. Subtitles whose last cue is
+        # within duration_tolerance of movie runtime are good enough to be
+        # used without waiting for the other candidates.
+        self.min_cues = min_cues
+        self.duration_tolerance = duration_tolerance
+
+    @property
+    def configuration(self):
+        if self._configuration is None:
+            with self.configuration_lock:
+                if self._configuration is None:
+                    self.reload_configuration()
+        elif time.monotonic() - self.configuration_loaded_at >= self.configuration_refresh_interval:
+            # Only one request refreshes the configuration, the others keep
+            # using the current one in the meantime
+            if self.configuration_lock.acquire(blocking=False):
+                try:
+                    self.reload_configuration()
+                finally:
+                    self.configuration_lock.release()
+        return self._configuration
+
+    def reload_configuration(self):
+        configuration, refreshed = self.load_configuration()
+        self._configuration = configuration
+        self.configuration_loaded_at = time.monotonic()
+
+        # If the configuration could not be downloaded, try again in an hour
+        if not refreshed:
+            self.configuration_loaded_at -= max(self.configuration_refresh_interval - 60 * 60, 0)
+
+    def load_configuration(self):
+        """Return saved or downloaded configuration and whether it is up to date"""
+        saved_configuration = None
+        try:
+            with open(self.configuration_file, 'r') as configuration_file:
+                saved_configuration = json.load(configuration_file)
+            if time.time() - os.path.getmtime(self.configuration_file) < self.configuration_refresh_interval:
+                return saved_configuration, True
+        except (OSError, ValueError):
+            pass
+
+        try:
+            with timed('TMDB configuration download'):
+                configuration = tmdb.Configuration().info()
+        except Exception as e:
+            # Use the saved configuration even if it is old, image URLs rarely
+            # change
+            print('TMDB configuration could not be downloaded: {}'.format(e))
+            return (saved_configuration if saved_configuration is not None else DEFAULT_CONFIGURATION), False
+
+        try:
+            with open(self.configuration_file, 'w') as configuration_file:
+                json.dump(configuration, configuration_file)
+        except OSError as e:
+            print('TMDB configuration could not be saved: {}'.format(e))
+        return configuration, True
+
+    def login(self, force=False):
+        """Make sure the OpenSubtitles token is valid, logging in if needed"""
+        with self.login_lock:
+            if force or self.token is None or time.monotonic() >= self.token_expires_at:
+                # Only the first login is part of the startup time
+                with timed('OpenSubtitles login') if self.token is None else nullcontext():
+                    self.token = self.opensubtitles.login(self.opensubtitles_username, self.opensubtitles_password)
+                if self.token is None:
+                    raise SubtitleServiceUnavailableException()
+
+            # Tokens expire after some time without requests, each request
+            # extends its lifetime
+            self.token_expires_at = time.monotonic() + self.token_lifetime
     
     def get_imdb_id(self, movie):
         """Get movie IMDB id from Movie object by TMDB id"""
-        tmbd_movie = tmdb.Movies(movie.id)
-        response = tmbd_movie.info()
+        # Movies that were downloaded from TMDB movie information endpoint
+        # already know their IMDB id
+        if movie.imdb_id:
+            return int(movie.imdb_id.replace('tt', ''))
+
+        response = self.get_movie_information(movie.id)
 
         # After additional movie information is received, add it to the Movie
         # object.
@@ -53,13 +226,16 @@ class SubtitleService(object):
     
     def get_suggestions(self, query):
         # Create a new search object and use it to find movies matching query
-        search = tmdb.Search()
-        response = search.movie(query=query)
+        def search_movies():
+            return tmdb.Search().movie(query=query)
+
+        key = ' '.join(query.lower().split())
+        response = self.cache.get_or_set('search', key, search_movies)
         
         # After data has been downloaded a list of Movie objects should be
         # constructed.
         suggestions = []
-        for movie in search.results:
+        for movie in response.get('results', []):
             try:
                 # Try to extract the needed information from each result
                 suggestions.append(self.parse_movie(movie))
@@ -73,10 +249,17 @@ class SubtitleService(object):
     def find_subtitles(self, imdb_id, language='eng'):
         # Use OpenSubtitles database to find subtitles for specific movie using
         # IMDB id.
-        data = self.opensubtitles.search_subtitles([{
+        query = [{
             'sublanguageid': language,
             'imdbid': imdb_id
-        }])
+        }]
+        self.login()
+        data = self.opensubtitles.search_subtitles(query)
+
+        # The token might have expired on the server, log in again and retry
+        if data is None:
+            self.login(force=True)
+            data = self.opensubtitles.search_subtitles(query)
         
         if data is None:
             return None
@@ -90,26 +273,119 @@ class SubtitleService(object):
             return subtitles
 
     def download_subtitles(self, url):
-        """Download gzipped subtitles from URL, extracts them in memory and returns srt object"""
+        """Download gzipped subtitles from URL to a temporary "utf-8" encoded file and return its path"""
         # OpenSubtitles service can automatically convert subtitles from their
         # encoding to "utf-8" (experimentally).
         download_url = url.replace('filead', 'subencoding-utf8/filead')
-        
-        # Download subtitles from OpenSubtitles and decompress gzip in memory
-        response = urllib.request.urlopen(download_url)
-        compressed_file = io.BytesIO(response.read())
-        decompressed_file = gzip.GzipFile(fileobj=compressed_file)
-        bytes = decompressed_file.read()
-        
-        # Read contents of the decompressed file (.srt filetype), ASSUME it is
-        # "utf-8" encoded and use the srt parser to parse subtitles file
-        file_content = bytes.decode('utf-8')
-        subtitle_generator = srt.parse(file_content)
 
-        return bytes, subtitle_generator
+        file_descriptor, path = tempfile.mkstemp(suffix='.srt')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as subtitle_file:
+                is_utf8 = self.stream_subtitles(download_url, subtitle_file)
+
+            # The conversion does not always work, so the encoding is detected
+            # and the file is converted here
+            if not is_utf8:
+                self.convert_to_utf8(path)
+        except Exception:
+            os.remove(path)
+            raise
+
+        return path
+
+    def stream_subtitles(self, url, output_file):
+        """Decompress subtitles to output_file while they are downloaded and return whether they are valid utf-8"""
+        response = self.session.get(url, timeout=self.download_timeout, stream=True)
+        try:
+            response.raise_for_status()
+
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            is_utf8 = True
+            size = 0
+
+            # The response is gzip file itself, so it is read without HTTP
+            # content decoding
+            for chunk in response.raw.stream(64 * 1024, decode_content=False):
+                while chunk:
+                    # At most one byte more than allowed is decompressed at
+                    # once, so that a small file can not fill up the memory
+                    data = decompressor.decompress(chunk, self.max_size - size + 1)
+                    chunk = decompressor.unconsumed_tail
+
+                    size += len(data)
+                    if size > self.max_size:
+                        raise ValueError('Subtitles are larger than {} bytes'.format(self.max_size))
+
+                    if is_utf8:
+                        try:
+                            decoder.decode(data)
+                        except UnicodeDecodeError:
+                            is_utf8 = False
+                    output_file.write(data)
+
+            if not decompressor.eof:
+                raise ValueError('Subtitles file is incomplete')
+            if is_utf8:
+                try:
+                    decoder.decode(b'', final=True)
+                except UnicodeDecodeError:
+                    is_utf8 = False
+            return is_utf8
+        finally:
+            response.close()
+
+    def convert_to_utf8(self, path):
+        encoding = detect_encoding(path)
+        converted_path = path + '.utf8'
+        with open(path, 'r', encoding=encoding, errors='replace') as input_file:
+            with open(converted_path, 'w', encoding='utf-8') as output_file:
+                for line in input_file:
+                    output_file.write(line)
+        os.replace(converted_path, path)
+
+    def score_subtitles(self, movie, path):
+        """Return how far (relative to movie runtime) the last cue is from the end of movie or None if subtitles are not usable"""
+        # Subtitles are parsed one cue at a time, only their number and end of
+        # the last one are needed
+        number_of_cues, subtitles_end = 0, None
+        for subtitle in parse_subtitles_file(path):
+            number_of_cues += 1
+            subtitles_end = subtitle.end if subtitles_end is None else max(subtitles_end, subtitle.end)
+
+        if number_of_cues < self.min_cues:
+            return None
+
+        # Runtime is not known for all movies, such subtitles are only
+        # checked for the number of cues
+        if not movie.duration:
+            return 0
+
+        # Subtitles usually end a few minutes before the credits. Subtitles for
+        # a different cut or frame rate of the movie end much sooner or later.
+        subtitles_duration = subtitles_end.total_seconds() / 60
+        difference = abs(movie.duration - subtitles_duration) / movie.duration
+        if difference > 3 * self.duration_tolerance:
+            return None
+        return difference
+
+    def download_candidate(self, movie, found_subtitle):
+        path = self.download_subtitles(found_subtitle['SubDownloadLink'])
+
+        # Subtitles are parsed here, so that invalid files are rejected
+        # before they are saved
+        try:
+            score = self.score_subtitles(movie, path)
+        except Exception:
+            os.remove(path)
+            raise
+
+        if score is None:
+            os.remove(path)
+        return path, score
 
     def get_subtitles(self, movie, language='eng'):
-        """Search subtitles by Movie object and return srt object"""
+        """Search subtitles by Movie object and return path of temporary "utf-8" encoded .srt file, which must be removed by the caller"""
         # Get movie IMDB id from its TMDB id
         imdb_id = self.get_imdb_id(movie)
 
@@ -118,30 +394,67 @@ class SubtitleService(object):
         if found_subtitles is None:
             raise SubtitlesNotFoundException(movie.title)
 
-        for found_subtitle in found_subtitles:
-            try:
-                # Get subtitle download link and try to download subtitles. If
-                # subtitles are successfully downloaded, end the loop, otherwise
-                # try to download the next ones.
-                download_link = found_subtitle['SubDownloadLink']
-                if download_link is not None:
-                    file_content, subtitle_generator = self.download_subtitles(download_link)
-                    if subtitle_generator is not None:
-                        return file_content, subtitle_generator
-            except Exception as e:
-                print('Subtitles for {} could not be parsed: {}'.format(movie, e))
-            
-            return None, None
+        # The most downloaded subtitles are downloaded at the same time and the
+        # first one that matches the movie is used. If none of them is good
+        # enough, the one closest to movie runtime is used.
+        found_subtitles = [subtitle for subtitle in found_subtitles if subtitle.get('SubDownloadLink')]
+        # Each request downloads its candidates in its own threads, so that
+        # the timeout does not include waiting for downloads of other movies
+        executor = ThreadPoolExecutor(max_workers=self.candidates)
+        futures = {}
+        for rank, found_subtitle in enumerate(found_subtitles[:self.candidates]):
+            futures[executor.submit(self.download_candidate, movie, found_subtitle)] = rank
+
+        best, best_key = None, None
+        try:
+            for future in as_completed(futures, timeout=2 * self.download_timeout):
+                try:
+                    path, score = future.result()
+                except Exception as e:
+                    print('Subtitles for {} could not be parsed: {}'.format(movie, e))
+                    continue
+
+                if score is None:
+                    continue
+                if score <= self.duration_tolerance:
+                    best, best_key = path, None
+                    break
+
+                # More downloaded subtitles are preferred when they are
+                # equally close to movie runtime
+                key = (score, futures[future])
+                if best_key is None or key < best_key:
+                    best, best_key = path, key
+        except TimeoutError:
+            print('Subtitles for {} could not be downloaded in time'.format(movie))
+        finally:
+            # Downloads that have not started yet are no longer needed and
+            # files of the other candidates are removed once they finish
+            for future in futures:
+                future.cancel()
+                future.add_done_callback(lambda future: remove_candidate(future, best))
+            executor.shutdown(wait=False)
+
+        if best is None:
+            raise SubtitlesNotFoundException(movie.title)
+        return best
     
-    def get_movie(self, movie_id):
+    def get_movie_information(self, movie_id):
         # Get information from TMDB using movie_id
-        tmbd_movie = tmdb.Movies(movie_id)
-        response = tmbd_movie.info()
+        return self.cache.get_or_set('movie', str(movie_id), lambda: tmdb.Movies(movie_id).info())
+
+    def get_movie(self, movie_id):
+        response = self.get_movie_information(movie_id)
         return self.parse_movie(response)
     
     def get_popular(self, page=1):
-        trending = tmdb.Trending(media_type='movie', time_window='week')
-        results = trending.info(page=page)
+        def get_trending():
+            trending = tmdb.Trending(media_type='movie', time_window='week')
+            return trending.info(page=page)
+
+        # Trending movies change slowly, so stale results are returned while
+        # the new ones are downloaded in the background
+        results = self.cache.get_or_set('trending', str(page), get_trending)
 
         movies = []
         for result in results['results']:
@@ -150,17 +463,33 @@ class SubtitleService(object):
             except Exception as e:
                 print('Cannot parse popular result: '.format(e))
 
+        # Games for trending movies are generated in advance by the
+        # precompute_trending management command, attach the best rated ones.
+        # Each movie only reads its best games using the rating index, the
+        # queries are combined into one if the database supports it.
+        queries = [
+            Game.objects.filter(movie_id=str(movie.id)).order_by('-rating_average', '-rating_count', '-created_at')[:self.games_per_movie]
+            for movie in movies
+        ]
+        if len(queries) > 1 and connection.features.supports_slicing_ordering_in_compound:
+            queries = [queries[0].union(*queries[1:], all=True)]
+
+        games = defaultdict(list)
+        for query in queries:
+            for game in query:
+                games[game.movie_id].append(game)
+
         trending_movies = []
         for movie in movies:
             movie_object = movie.to_dict(self, 4)
 
-            drinking_game = {
-                "id": "test",
-                "words": [],
-                "bonus_words": []
-            }
-
-            movie_object['games'] = [drinking_game for i in range(4)]
+            # Combined queries don't keep the order of games
+            movie_games = sorted(games[str(movie.id)], reverse=True, key=lambda game: (
+                game.rating_average,
+                game.rating_count,
+                game.created_at.timestamp() if game.created_at is not None else 0
+            ))
+            movie_object['games'] = [game.to_dict() for game in movie_games]
             trending_movies.append(movie_object)
 
-        return trending_movies
\ No newline at end of file
+        return trending_movies
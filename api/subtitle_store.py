@@ -0,0 +1,127 @@
+from array import array
+from datetime import timedelta
+import mmap
+import re
+import struct
+import sys
+import zlib
+
+import srt
+
+# Subtitles are stored in a compact binary format instead of .srt files, so
+# that they don't need to be parsed again every time they are read. The file
+# starts with a header (magic bytes, format version, flags and number of cues),
+# followed by three arrays of unsigned 32 bit little endian integers (start
+# and end of each cue in milliseconds and offsets of cue texts) and "utf-8"
+# encoded texts of all cues. If the file is compressed, everything after the
+# header is compressed with zlib.
+MAGIC = b'MSUB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+COMPRESSED = 1
+MILLISECOND = timedelta(milliseconds=1)
+
+TAG_PATTERN = re.compile(r'<[^>]*>|\{\\[^}]*\}')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def normalize_text(text):
+    # Formatting tags (<i>, {\an8}) and line breaks are not needed to find
+    # words in subtitles
+    return WHITESPACE_PATTERN.sub(' ', TAG_PATTERN.sub('', text)).strip()
+
+def to_little_endian(values):
+    if sys.byteorder != 'little':
+        values = array('I', values)
+        values.byteswap()
+    return values
+
+def write_subtitles(subtitles, output_file, compress=False):
+    """Write srt.Subtitle objects to binary file in compact format"""
+    starts, ends, offsets = array('I'), array('I'), array('I', [0])
+    texts = bytearray()
+    for subtitle in subtitles:
+        text = normalize_text(subtitle.content)
+        if not text:
+            continue
+        # Times are divided as integers, truncated floating point seconds
+        # can be 1 ms too low
+        starts.append(subtitle.start // MILLISECOND)
+        ends.append(subtitle.end // MILLISECOND)
+        texts += text.encode('utf-8')
+        offsets.append(len(texts))
+
+    body = b''.join([
+        to_little_endian(starts).tobytes(),
+        to_little_endian(ends).tobytes(),
+        to_little_endian(offsets).tobytes(),
+        bytes(texts)
+    ])
+    if compress:
+        body = zlib.compress(body)
+
+    output_file.write(HEADER.pack(MAGIC, VERSION, COMPRESSED if compress else 0, len(starts)))
+    output_file.write(body)
+
+class CompactSubtitles(object):
+    """Subtitles in compact format that are read directly from a buffer"""
+
+    def __init__(self, buffer):
+        magic, version, flags, length = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unsupported subtitles file format')
+
+        body = memoryview(buffer)[HEADER.size:]
+        if flags & COMPRESSED:
+            body = memoryview(zlib.decompress(body))
+        self.length = length
+
+        # Arrays are used without copying on little endian machines
+        def read_array(start, size):
+            values = body[start * 4:(start + size) * 4]
+            if sys.byteorder == 'little':
+                return values.cast('I')
+            return to_little_endian(array('I', values.tobytes()))
+
+        self.starts = read_array(0, length)
+        self.ends = read_array(length, length)
+        self.offsets = read_array(2 * length, length + 1)
+        self.texts = body[(3 * length + 1) * 4:]
+
+    def __len__(self):
+        return self.length
+
+    def text(self, index):
+        return str(self.texts[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def __getitem__(self, index):
+        return srt.Subtitle(
+            index + 1,
+            timedelta(milliseconds=self.starts[index]),
+            timedelta(milliseconds=self.ends[index]),
+            self.text(index)
+        )
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def release(self):
+        # Memory mapped file can only be closed once there are no views of it
+        for view in (self.starts, self.ends, self.offsets, self.texts):
+            if isinstance(view, memoryview):
+                view.release()
+
+def read_subtitles(path):
+    """Read subtitles in compact format one cue at a time"""
+    with open(path, 'rb') as subtitle_file:
+        # Uncompressed files are memory mapped, so they are never copied into
+        # memory as a whole
+        buffer = mmap.mmap(subtitle_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            subtitles = CompactSubtitles(buffer)
+            try:
+                yield from subtitles
+            finally:
+                subtitles.release()
+        finally:
+            buffer.close()
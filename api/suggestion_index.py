@@ -0,0 +1,136 @@
+from django.db.models import Count
+
+from .models import Movie
+
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+def normalize(text):
+    # Remove accents and punctuation, so that "Amélie" matches "amelie" and
+    # "Spider-Man" matches "spider man"
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+class SuggestionIndex(object):
+    """In-memory autocomplete index over titles of movies in local database"""
+
+    def __init__(self, refresh_interval=60 * 60):
+        self.lock = threading.RLock()
+
+        # Sorted list of (token, movie id) pairs used for prefix search
+        self.tokens = []
+
+        # Movie objects, their normalized titles and ranking information
+        self.movies = {}
+        self.titles = {}
+        self.game_counts = {}
+        self.ratings = {}
+
+        # Each web server process has its own index, which only sees movies
+        # saved by that process. It is rebuilt periodically to include movies
+        # saved by other processes.
+        self.refresh_interval = refresh_interval
+        self.built_at = None
+
+    def build(self):
+        movies = Movie.objects.defer('additional_data').annotate(game_count=Count('game'))
+
+        with self.lock:
+            self.tokens = []
+            self.movies, self.titles, self.game_counts, self.ratings = {}, {}, {}, {}
+            for movie in movies:
+                self.add(movie, movie.game_count, movie.rating_average, sort=False)
+            self.tokens.sort()
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.built_at is None or time.monotonic() - self.built_at > self.refresh_interval:
+            self.build()
+
+    def add(self, movie, game_count=None, average_rating=None, sort=True):
+        with self.lock:
+            movie_id = str(movie.id)
+            self.remove(movie_id)
+
+            title = normalize(movie.title or '')
+            self.movies[movie_id] = movie
+            self.titles[movie_id] = title
+            self.game_counts[movie_id] = game_count if game_count is not None else self.game_counts.get(movie_id, 0)
+            self.ratings[movie_id] = average_rating if average_rating is not None else self.ratings.get(movie_id, None)
+
+            for token in set(title.split()):
+                if sort:
+                    bisect.insort(self.tokens, (token, movie_id))
+                else:
+                    self.tokens.append((token, movie_id))
+
+    def remove(self, movie_id):
+        with self.lock:
+            title = self.titles.pop(movie_id, None)
+            self.movies.pop(movie_id, None)
+            if title is None:
+                return
+
+            for token in set(title.split()):
+                index = bisect.bisect_left(self.tokens, (token, movie_id))
+                if index < len(self.tokens) and self.tokens[index] == (token, movie_id):
+                    del self.tokens[index]
+
+    def find_prefix(self, prefix):
+        # All tokens starting with prefix are stored next to each other in the
+        # sorted token list
+        movie_ids = set()
+        index = bisect.bisect_left(self.tokens, (prefix, ''))
+        while index < len(self.tokens) and self.tokens[index][0].startswith(prefix):
+            movie_ids.add(self.tokens[index][1])
+            index += 1
+        return movie_ids
+
+    def search(self, query, limit=10):
+        """Return a list of Movie objects whose titles match the query"""
+        self.ensure_built()
+
+        query = normalize(query)
+        query_tokens = query.split()
+        if len(query_tokens) <= 0:
+            return []
+
+        with self.lock:
+            # Each query token must be a prefix of at least one title token
+            movie_ids = None
+            for token in query_tokens:
+                matches = self.find_prefix(token)
+                movie_ids = matches if movie_ids is None else movie_ids & matches
+                if not movie_ids:
+                    return []
+
+            # Titles starting with the query are shown first, then movies with
+            # more and better rated games
+            def rank(movie_id):
+                rating = self.ratings.get(movie_id, None)
+                return (
+                    not self.titles[movie_id].startswith(query),
+                    -self.game_counts.get(movie_id, 0),
+                    -(rating if rating is not None else 0),
+                    len(self.titles[movie_id])
+                )
+
+            return [self.movies[movie_id] for movie_id in sorted(movie_ids, key=rank)[:limit]]
+
+    def movie_saved(self, sender, instance, **kwargs):
+        if self.built_at is not None:
+            self.add(instance)
+
+    def movie_deleted(self, sender, instance, **kwargs):
+        self.remove(str(instance.id))
+
+    def game_saved(self, sender, instance, created=False, **kwargs):
+        if created and self.built_at is not None:
+            with self.lock:
+                movie_id = str(instance.movie_id)
+                if movie_id in self.game_counts:
+                    self.game_counts[movie_id] += 1
@@ -1,3 +1,765 @@
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
 
-# Create your tests here.
+from .exceptions import *
+from .models import User, Movie, Game, GameJob, Rating
+from .jobs import GameJobRunner
+from .analyzer import SubtitleAnalyzer
+from .ratings import RatingBuffer
+from .middleware import ApiKeyMiddleware
+from .cache import DjangoCacheBackend, MemoryCacheBackend, ResponseCache
+from .services import create_subtitle_service, create_subtitle_analyzer, create_game_service
+from .generator import DrinkingGame, WordIndex
+from .game_service import GameService
+from . import subtitle_store
+from .subtitle_service import SubtitleService, parse_subtitles_file
+from .suggestion_index import SuggestionIndex
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import collections
+import itertools
+import json
+import os
+import shutil
+import srt
+import statistics
+import tempfile
+import threading
+import time
+import warnings
+
+from datetime import timedelta
+from django.utils import timezone
+
+# Subtitles with empty lines inside the first cue and a cue whose text is a
+# number
+SUBTITLES = (
+    '1\n00:00:01,000 --> 00:00:02,500\n<i>Hello</i>\n\nthere\n\n'
+    '2\n00:00:03,000 --> 00:00:04,000\n42\n\n\n'
+    '3\n00:00:05,000 --> 00:00:06,000\nGood  bye\nmy friend\n'
+)
+
+def write_temporary_file(content, suffix='.srt'):
+    file_descriptor, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(file_descriptor, 'w', encoding='utf-8') as temporary_file:
+        temporary_file.write(content)
+    return path
+
+class ApiKeyMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.middleware = ApiKeyMiddleware(lambda request: HttpResponse())
+
+    def test_user_is_created_once(self):
+        user = self.middleware.get_user('key')
+        self.assertEqual(self.middleware.get_user('key').id, user.id)
+        self.assertNotEqual(self.middleware.get_user('other key').id, user.id)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_cached_user_does_not_query_database(self):
+        user = self.middleware.get_user('key')
+        with self.assertNumQueries(0):
+            cached_user = self.middleware.get_user('key')
+            self.assertEqual((cached_user.id, cached_user.api_key), (user.id, 'key'))
+
+    def test_existing_user_is_found(self):
+        user = User.objects.create(api_key='key')
+        self.assertEqual(self.middleware.get_user('key').id, user.id)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_user_is_only_loaded_when_used(self):
+        request = RequestFactory().get('/suggestions', {'api_key': 'key'})
+        with self.assertNumQueries(0):
+            self.middleware(request)
+        self.assertEqual(User.objects.count(), 0)
+
+        self.assertEqual(request.api_user.api_key, 'key')
+        self.assertEqual(User.objects.count(), 1)
+
+class RatingBufferTests(TestCase):
+
+    def setUp(self):
+        self.movie = Movie.objects.create(id='1', title='Movie')
+        self.games = [Game.objects.create(movie=self.movie, number_of_players=2, intoxication_level=4, number_of_bonus_words=1) for i in range(2)]
+        self.users = [User.objects.create(api_key='user-{}'.format(i)) for i in range(2)]
+        self.buffer = RatingBuffer(max_attempts=2)
+
+    def test_new_and_changed_ratings_update_aggregates(self):
+        self.buffer.add(self.users[0].id, self.games[0].id, 4)
+        self.buffer.add(self.users[1].id, self.games[0].id, 2)
+        self.buffer.add(self.users[0].id, self.games[1].id, 5)
+        self.assertEqual(self.buffer.flush(), 3)
+
+        # Rating the same game again replaces the old rating
+        self.buffer.add(self.users[0].id, self.games[0].id, 1)
+        self.assertEqual(self.buffer.flush(), 1)
+
+        self.assertEqual(Rating.objects.count(), 3)
+        game = Game.objects.get(id=self.games[0].id)
+        self.assertEqual((game.rating_count, game.rating_sum, game.rating_average), (2, 3, 1.5))
+        movie = Movie.objects.get(id=self.movie.id)
+        self.assertEqual((movie.rating_count, movie.rating_sum, movie.rating_average), (3, 8, 8 / 3))
+
+    def test_last_rating_before_flush_is_kept(self):
+        self.buffer.add(self.users[0].id, self.games[0].id, 1)
+        self.buffer.add(self.users[0].id, self.games[0].id, 3)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Rating.objects.get().rating, 3)
+
+    def test_ratings_of_missing_games_are_dropped(self):
+        self.buffer.add(self.users[0].id, 1000, 3)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.stats()['dropped'], 1)
+
+    def test_non_finite_ratings_are_rejected(self):
+        self.assertFalse(self.buffer.add(self.users[0].id, self.games[0].id, float('nan')))
+        self.assertFalse(self.buffer.add(self.users[0].id, self.games[0].id, float('inf')))
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+    def test_failing_rating_does_not_block_other_ratings(self):
+        # NaN is stored as NULL, which violates the NOT NULL constraint
+        self.buffer.pending[(self.users[0].id, self.games[0].id)] = float('nan')
+        self.buffer.add(self.users[1].id, self.games[0].id, 4)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.stats()['pending'], 1)
+
+        # The failing rating is retried and dropped after max_attempts
+        self.assertEqual(self.buffer.flush(), 0)
+        stats = self.buffer.stats()
+        self.assertEqual((stats['pending'], stats['failed'], stats['flushed']), (0, 1, 1))
+
+        self.buffer.add(self.users[0].id, self.games[1].id, 2)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Game.objects.get(id=self.games[0].id).rating_average, 4)
+
+class RateGameViewTests(TestCase):
+
+    def setUp(self):
+        from . import views
+        self.views = views
+        self.user = User.objects.create(api_key='user')
+
+    def rate(self, rating):
+        request = RequestFactory().get('/game/rate', {'game': '1', 'rating': rating})
+        request.api_user = self.user
+        return self.views.rate_game(request)
+
+    def test_invalid_ratings_are_rejected(self):
+        for rating in ['nan', 'inf', '-inf', '-1', '5.5', 'abc']:
+            with self.assertRaises(InvalidParametersException):
+                self.rate(rating)
+
+    def test_valid_rating_is_buffered(self):
+        pending = self.views.rating_buffer.stats()['pending']
+        self.assertEqual(self.rate('4.5').status_code, 200)
+        self.assertEqual(self.views.rating_buffer.stats()['pending'], pending + 1)
+        self.views.rating_buffer.pending.clear()
+
+class ParseSubtitlesFileTests(TestCase):
+
+    def setUp(self):
+        self.path = write_temporary_file(SUBTITLES)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_cues_match_whole_file_parse(self):
+        self.assertEqual(list(parse_subtitles_file(self.path)), list(srt.parse(SUBTITLES)))
+
+    def test_empty_lines_inside_cue(self):
+        self.assertEqual([subtitle.content for subtitle in parse_subtitles_file(self.path)][0], '<i>Hello</i>\n\nthere')
+
+class LegacySubtitlesTests(TestCase):
+
+    def setUp(self):
+        # Stored subtitles are opened by their URL, which is relative to the
+        # working directory
+        self.working_directory = os.getcwd()
+        self.media_root = tempfile.mkdtemp()
+        os.chdir(self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='')
+        self.settings_override.enable()
+
+        movie = Movie.objects.create(id='1', title='Movie')
+        movie.subtitles_file.save('1.srt', ContentFile(SUBTITLES.encode('utf-8')))
+        self.movie = Movie.objects.get(id='1')
+        self.game_service = GameService(None)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.media_root)
+
+    def test_legacy_subtitles_are_converted(self):
+        subtitles = list(self.game_service.get_subtitles(self.movie))
+        self.assertEqual([subtitle.content for subtitle in subtitles], ['Hello there', '42', 'Good bye my friend'])
+
+        movie = Movie.objects.get(id='1')
+        self.assertEqual(movie.subtitles_format, subtitle_store.VERSION)
+        self.assertTrue(movie.subtitles_file.name.endswith('.subs'))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'subtitles', '1.srt')))
+
+    def test_legacy_subtitles_are_read_if_conversion_fails(self):
+        with mock.patch.object(subtitle_store, 'write_subtitles', side_effect=ValueError('broken')):
+            subtitles = list(self.game_service.get_subtitles(self.movie))
+        self.assertEqual(subtitles, list(srt.parse(SUBTITLES)))
+
+        movie = Movie.objects.get(id='1')
+        self.assertEqual(movie.subtitles_format, Movie.SRT_FORMAT)
+        self.assertEqual(movie.subtitles_file.name, 'subtitles/1.srt')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'subtitles', '1.srt')))
+
+class SubtitleAnalyzerTests(TestCase):
+
+    def setUp(self):
+        # Jobs run in threads instead of worker processes and wait until the
+        # test lets them finish
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        self.finish = threading.Event()
+        self.addCleanup(self.finish.set)
+
+        self.analyzer = SubtitleAnalyzer(workers=1, queue_size=0, timeout=0.05)
+        self.analyzer.get_executor = lambda: executor
+
+        patcher = mock.patch('api.analyzer.analyze_texts', self.analyze_texts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.movie = Movie(id='1', title='Movie')
+        self.subtitles = list(srt.parse(SUBTITLES))
+
+    def analyze_texts(self, texts):
+        self.finish.wait(5)
+        return [(text, 1) for text in texts]
+
+    def test_jobs_time_out_and_keep_their_slot_until_finished(self):
+        with self.assertRaises(AnalysisTimeoutException):
+            self.analyzer.get_words(self.movie, self.subtitles)
+
+        # The job that timed out is still running
+        with self.assertRaises(ServerBusyException):
+            self.analyzer.get_words(self.movie, self.subtitles)
+
+        self.finish.set()
+        self.assertTrue(self.analyzer.slots.acquire(timeout=5))
+        self.analyzer.slots.release()
+
+        self.analyzer.timeout = 5
+        words = self.analyzer.get_words(self.movie, self.subtitles)
+        self.assertEqual(words, [(subtitle.content, 1) for subtitle in self.subtitles])
+
+class GenerateGamesTests(TestCase):
+
+    def setUp(self):
+        self.movie = Movie.objects.create(id='1', title='Movie')
+        self.game_service = GameService(None)
+        words = [('word{}'.format(i), i % 7 + 1) for i in range(40)]
+        self.game_service.get_words = lambda movie: words
+
+    def test_invalid_variants_return_errors(self):
+        variants = [(2, 8, 1), (-1, 8, 1), (0, 8, 1), (2, 0, 1), (2, 8, -1)]
+        results = self.game_service.generate_games(self.movie, variants)
+
+        self.assertIsInstance(results[0], Game)
+        self.assertIsNotNone(results[0].id)
+        for result in results[1:]:
+            self.assertIsInstance(result, InvalidParameterValueException)
+        self.assertEqual(Game.objects.count(), 1)
+
+    def test_too_large_variants_return_errors(self):
+        variants = [(21, 8, 1), (2, 101, 1), (2, 8, 11)]
+        for result in self.game_service.generate_games(self.movie, variants):
+            self.assertIsInstance(result, ParameterValueTooLargeException)
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_game_without_bonus_words_can_be_shared(self):
+        from .views import render_share_page
+        game, = self.game_service.generate_games(self.movie, [(2, 8, 0)])
+        self.assertEqual(game.to_dict()['bonus_words'], [])
+        self.assertIn('Movie', render_share_page(Game.objects.select_related('movie').get(id=game.id)))
+
+class SuggestionIndexTests(TestCase):
+
+    def setUp(self):
+        self.movies = {}
+        for movie_id, title, games in [('1', 'The Dark Knight', 1), ('2', 'Dark City', 3), ('3', 'Knight and Day', 0), ('4', 'Amélie', 0)]:
+            self.movies[movie_id] = Movie.objects.create(id=movie_id, title=title)
+            for i in range(games):
+                Game.objects.create(movie=self.movies[movie_id], number_of_players=2, intoxication_level=4, number_of_bonus_words=1)
+        self.index = SuggestionIndex()
+
+    def search(self, query, **kwargs):
+        return [movie.title for movie in self.index.search(query, **kwargs)]
+
+    def test_all_query_tokens_must_match_prefixes(self):
+        self.assertEqual(self.search('dark kni'), ['The Dark Knight'])
+        self.assertEqual(self.search('kn'), ['Knight and Day', 'The Dark Knight'])
+        self.assertEqual(self.search('dark moon'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_accents_and_punctuation_are_ignored(self):
+        self.assertEqual(self.search('AMELIE'), ['Amélie'])
+        self.assertEqual(self.search('the-dark'), ['The Dark Knight'])
+
+    def test_movies_are_ranked(self):
+        # Titles starting with the query are first, then movies with more
+        # games
+        self.assertEqual(self.search('dark'), ['Dark City', 'The Dark Knight'])
+        self.assertEqual(self.search('d'), ['Dark City', 'The Dark Knight', 'Knight and Day'])
+        self.assertEqual(self.search('d', limit=1), ['Dark City'])
+
+    def test_renamed_and_deleted_movies_are_updated(self):
+        self.index.build()
+        movie = self.movies['1']
+        movie.title = 'Batman Begins'
+        self.index.movie_saved(Movie, movie)
+        self.assertEqual(self.search('knight'), ['Knight and Day'])
+        self.assertEqual(self.search('batman'), ['Batman Begins'])
+
+        self.index.movie_deleted(Movie, self.movies['3'])
+        self.assertEqual(self.search('knight'), [])
+        self.assertEqual(self.index.tokens, sorted(self.index.tokens))
+
+    def test_index_is_refreshed(self):
+        self.index.build()
+        Movie.objects.bulk_create([Movie(id='5', title='Dark Water')])
+        self.assertEqual(self.search('water'), [])
+
+        self.index.built_at -= self.index.refresh_interval + 1
+        self.assertEqual(self.search('water'), ['Dark Water'])
+
+    def test_suggestions_are_completed_from_tmdb(self):
+        from . import views
+        request = RequestFactory().get('/suggestions', {'keywords': 'dark'})
+        remote_suggestions = [Movie(id='2', title='Dark City'), Movie(id='6', title='Dark Shadows')]
+        with mock.patch.object(views, 'suggestion_index', self.index), \
+                mock.patch.object(views.subtitle_service, 'get_suggestions', return_value=(remote_suggestions, None)) as get_suggestions:
+            with mock.patch.object(views, 'SUGGESTIONS_MIN_LOCAL', 2):
+                response = views.suggestions(request)
+                self.assertEqual([movie['title'] for movie in json.loads(response.content)], ['Dark City', 'The Dark Knight'])
+                get_suggestions.assert_not_called()
+
+            with mock.patch.object(views, 'SUGGESTIONS_MIN_LOCAL', 5):
+                response = views.suggestions(request)
+                self.assertEqual([movie['title'] for movie in json.loads(response.content)], ['Dark City', 'The Dark Knight', 'Dark Shadows'])
+                get_suggestions.assert_called_once_with('dark')
+
+class GamePoolTests(TestCase):
+
+    def setUp(self):
+        self.movie = Movie.objects.create(id='1', title='Movie')
+        self.game_service = GameService(None, pool_size=3, pool_prior_rating=2.5)
+        words = [('word{}'.format(i), i % 7 + 1) for i in range(40)]
+        self.game_service.get_words = lambda movie: words
+
+    def test_games_are_generated_until_pool_is_full(self):
+        games = [self.game_service.get_game(self.movie, 2, 8) for i in range(3)]
+        self.assertEqual(len(set(game.id for game in games)), 3)
+
+        self.assertIn(self.game_service.get_game(self.movie, 2, 8).id, [game.id for game in games])
+        self.assertEqual(Game.objects.count(), 3)
+
+        # Games with other parameters have their own pool
+        self.assertNotIn(self.game_service.get_game(self.movie, 3, 8).id, [game.id for game in games])
+        self.assertEqual(Game.objects.count(), 4)
+
+    def test_games_are_weighted_by_rating(self):
+        for rating_count, rating_sum in [(10, 50), (0, 0), (98, 0)]:
+            Game.objects.create(
+                movie=self.movie,
+                number_of_players=2,
+                intoxication_level=8,
+                number_of_bonus_words=1,
+                rating_count=rating_count,
+                rating_sum=rating_sum,
+                rating_average=rating_sum / rating_count if rating_count > 0 else 0
+            )
+
+        with mock.patch('api.game_service.random.choices', side_effect=lambda pool, weights, k: [pool[0]]) as choices:
+            game = self.game_service.get_game(self.movie, 2, 8)
+
+        pool, = choices.call_args[0]
+        self.assertEqual(game.rating_count, 10)
+        self.assertEqual([game.rating_count for game in pool], [10, 98, 0])
+        # Games without ratings are weighted by the prior rating, badly rated
+        # games still have the minimum weight
+        self.assertEqual(choices.call_args[1]['weights'], [55 / 12, 0.1, 2.5])
+        self.assertEqual(Game.objects.count(), 3)
+
+class SubtitleCandidatesTests(TestCase):
+
+    def create_service(self, scores, delay=0, **kwargs):
+        subtitle_service = SubtitleService(candidates=len(scores), **kwargs)
+        subtitle_service.get_imdb_id = lambda movie: 'tt0000001'
+        subtitle_service.find_subtitles = lambda imdb_id, language: [
+            {'SubDownloadLink': str(rank)} for rank in range(len(scores))
+        ]
+
+        def download_candidate(movie, found_subtitle):
+            time.sleep(delay)
+            return write_temporary_file(found_subtitle['SubDownloadLink']), scores[int(found_subtitle['SubDownloadLink'])]
+        subtitle_service.download_candidate = download_candidate
+        return subtitle_service
+
+    def get_subtitles(self, subtitle_service):
+        path = subtitle_service.get_subtitles(Movie(id='1', title='Movie'))
+        with open(path) as subtitle_file:
+            rank = int(subtitle_file.read())
+        os.remove(path)
+        return rank
+
+    def test_closest_usable_candidate_is_chosen(self):
+        subtitle_service = self.create_service([None, 0.3, 0.2, 0.3], duration_tolerance=0.1)
+        self.assertEqual(self.get_subtitles(subtitle_service), 2)
+
+    def test_no_usable_candidate(self):
+        subtitle_service = self.create_service([None, None])
+        with self.assertRaises(SubtitlesNotFoundException):
+            subtitle_service.get_subtitles(Movie(id='1', title='Movie'))
+
+    def test_timeout_does_not_include_other_requests(self):
+        # Each download takes longer than half of the timeout, so requests
+        # would time out if they waited for each other
+        subtitle_service = self.create_service([0], delay=0.3, download_timeout=0.2)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda i: self.get_subtitles(subtitle_service), range(4)))
+        self.assertEqual(results, [0] * 4)
+
+class SubtitleServiceConfigurationTests(TestCase):
+
+    def setUp(self):
+        self.configuration_file = write_temporary_file('', suffix='.json')
+        os.remove(self.configuration_file)
+
+    def tearDown(self):
+        if os.path.exists(self.configuration_file):
+            os.remove(self.configuration_file)
+
+    def configuration(self, base_url):
+        return {'images': {'secure_base_url': base_url, 'poster_sizes': ['w92']}}
+
+    def test_configuration_is_downloaded_once_and_saved(self):
+        subtitle_service = SubtitleService(configuration_file=self.configuration_file)
+        with mock.patch('api.subtitle_service.tmdb.Configuration') as configuration:
+            configuration.return_value.info.return_value = self.configuration('https://first/')
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://first/')
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://first/')
+            self.assertEqual(configuration.call_count, 1)
+
+        # Another process reads the saved configuration
+        subtitle_service = SubtitleService(configuration_file=self.configuration_file)
+        with mock.patch('api.subtitle_service.tmdb.Configuration') as configuration:
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://first/')
+            self.assertEqual(configuration.call_count, 0)
+
+    def test_configuration_is_refreshed(self):
+        subtitle_service = SubtitleService(configuration_file=self.configuration_file, configuration_refresh_interval=0.1)
+        with mock.patch('api.subtitle_service.tmdb.Configuration') as configuration:
+            configuration.return_value.info.return_value = self.configuration('https://first/')
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://first/')
+
+            configuration.return_value.info.return_value = self.configuration('https://second/')
+            time.sleep(0.2)
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://second/')
+
+    def test_default_configuration_is_used_if_download_fails(self):
+        subtitle_service = SubtitleService(configuration_file=self.configuration_file)
+        with mock.patch('api.subtitle_service.tmdb.Configuration', side_effect=OSError('offline')):
+            self.assertEqual(subtitle_service.configuration['images']['secure_base_url'], 'https://image.tmdb.org/t/p/')
+
+    def test_login_does_not_wait_for_configuration(self):
+        subtitle_service = SubtitleService(configuration_file=self.configuration_file)
+        subtitle_service.opensubtitles.login = mock.Mock(return_value='token')
+        with subtitle_service.configuration_lock:
+            subtitle_service.login()
+        self.assertEqual(subtitle_service.token, 'token')
+
+        # The token is only renewed once it expires
+        subtitle_service.login()
+        self.assertEqual(subtitle_service.opensubtitles.login.call_count, 1)
+
+class ResponseCacheTests(TestCase):
+
+    def test_django_cache_keys_are_valid_memcached_keys(self):
+        backend = DjangoCacheBackend()
+        key = 'search:{}'.format('the matrix ' * 30)
+        with warnings.catch_warnings():
+            # Invalid memcached keys only cause a warning with local memory
+            # cache
+            warnings.simplefilter('error')
+            backend.set(key, 'value', 60)
+            self.assertEqual(backend.get(key), 'value')
+        self.assertIsNone(backend.get('search:the matrix'))
+
+    def test_hits_and_misses_are_counted(self):
+        cache = ResponseCache(ttl={'search': 60})
+        self.assertEqual(cache.get_or_set('search', 'matrix', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('search', 'matrix', lambda: 2), 1)
+        self.assertEqual(cache.stats(), {'search': {'hits': 1, 'misses': 1, 'stale_hits': 0}})
+
+    def test_stats_are_only_served_when_enabled(self):
+        from . import views
+        request = RequestFactory().get('/stats')
+        with mock.patch.object(views, 'STATS_ENABLED', False):
+            with self.assertRaises(views.Http404):
+                views.server_stats(request)
+        with mock.patch.object(views, 'STATS_ENABLED', True):
+            self.assertEqual(set(json.loads(views.server_stats(request).content)), {'tmdb_cache', 'ratings'})
+
+class GameJobTests(TestCase):
+
+    def setUp(self):
+        self.runner = GameJobRunner(None, workers=1, stale_after=600)
+
+    def create_job(self, age):
+        job = GameJob.objects.create(key='id:1:2:4', movie_id='1', number_of_players=2, intoxication_level=4)
+        GameJob.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(seconds=age))
+        return job
+
+    def test_lost_job_fails_when_polled(self):
+        job = self.create_job(age=601)
+        from . import views
+        with mock.patch.object(views, 'game_job_runner', self.runner):
+            response = json.loads(views.game_job(RequestFactory().get('/game/job'), job.id).content)
+        self.assertEqual(response['status'], GameJob.FAILED)
+
+        job = GameJob.objects.get(id=job.id)
+        self.assertEqual(job.status, GameJob.FAILED)
+        self.assertIsNone(job.key)
+
+    def test_recent_job_stays_pending(self):
+        job = self.create_job(age=10)
+        self.assertEqual(self.runner.get_job(job.id).status, GameJob.PENDING)
+
+    def test_missing_job(self):
+        with self.assertRaises(GameJobNotFoundException):
+            self.runner.get_job(1000)
+
+class ServicesTests(TestCase):
+
+    @override_settings(LOCK_DIRECTORY='/tmp/movie-locks', SUBTITLE_CANDIDATES=5, TMDB_CONFIGURATION_FILE='/tmp/configuration.json')
+    def test_services_are_configured_from_settings(self):
+        subtitle_service = create_subtitle_service()
+        game_service = create_game_service(subtitle_service, create_subtitle_analyzer(workers=0))
+        self.assertEqual(game_service.lock_directory, '/tmp/movie-locks')
+        self.assertEqual(game_service.analyzer.workers, 0)
+        self.assertEqual(subtitle_service.candidates, 5)
+        self.assertEqual(subtitle_service.configuration_file, '/tmp/configuration.json')
+
+class TrendingMoviesTests(TestCase):
+
+    def test_best_rated_games_are_read_for_each_movie(self):
+        for movie_id in ['1', '2']:
+            movie = Movie.objects.create(id=movie_id, title='Movie {}'.format(movie_id))
+            for rating in range(6):
+                Game.objects.create(
+                    movie=movie,
+                    number_of_players=2,
+                    intoxication_level=4,
+                    number_of_bonus_words=1,
+                    game_data=json.dumps({'rating': rating}),
+                    rating_average=rating
+                )
+
+        subtitle_service = SubtitleService(cache=ResponseCache())
+        results = {'results': [{'id': movie_id, 'title': 'Movie {}'.format(movie_id)} for movie_id in [1, 2, 3]]}
+        with mock.patch('api.subtitle_service.tmdb.Trending') as trending:
+            trending.return_value.info.return_value = results
+            # One query if the database can combine limited queries,
+            # otherwise one query for each movie
+            with self.assertNumQueries(1 if connection.features.supports_slicing_ordering_in_compound else 3):
+                movies = subtitle_service.get_popular()
+
+        self.assertEqual([[game['rating'] for game in movie['games']] for movie in movies], [[5, 4, 3, 2], [5, 4, 3, 2], []])
+
+class MovieGamesViewTests(TestCase):
+
+    def setUp(self):
+        from . import views
+        self.views = views
+        movie = Movie.objects.create(id='1', title='Movie')
+        for rating in range(3):
+            Game.objects.create(movie=movie, number_of_players=2, intoxication_level=4, number_of_bonus_words=1, game_data='{}', rating_average=rating)
+
+    def get_games(self, limit):
+        response = self.views.movie_games(RequestFactory().get('/movie/1/games', {'limit': limit}), '1')
+        return [game['rating'] for game in json.loads(response.content)]
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.get_games('2'), [2, 1])
+        self.assertEqual(self.get_games('-1'), [2])
+        self.assertEqual(self.get_games('0'), [2])
+        self.assertEqual(self.get_games('1000'), [2, 1, 0])
+
+class GameDetailsViewTests(TestCase):
+
+    def setUp(self):
+        from . import views
+        self.views = views
+        movie = Movie.objects.create(id='1', title='Movie')
+        # Games created before game data included the id
+        self.game = Game.objects.create(movie=movie, number_of_players=2, intoxication_level=4, number_of_bonus_words=1, game_data='{"words": []}')
+
+        patcher = mock.patch.object(views, 'game_payload_cache', MemoryCacheBackend(10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_game(self, **headers):
+        return self.views.game_details(RequestFactory().get('/game/{}'.format(self.game.id), **headers), self.game.id)
+
+    def test_legacy_game_is_serialized_once(self):
+        response = self.get_game()
+        self.assertEqual(json.loads(response.content), {'id': str(self.game.id), 'words': []})
+
+        game = Game.objects.get(id=self.game.id)
+        self.assertTrue(game.serialized)
+        self.assertEqual(json.loads(game.game_data)['id'], str(self.game.id))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_game().content, response.content)
+
+    def test_conditional_requests_are_not_modified(self):
+        first_response = self.get_game()
+        self.assertEqual(first_response.status_code, 200)
+
+        response = self.get_game(HTTP_IF_NONE_MATCH=first_response['ETag'])
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+        response = self.get_game(HTTP_IF_MODIFIED_SINCE=first_response['Last-Modified'])
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+        response = self.get_game(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_game(self):
+        with self.assertRaises(GameNotFoundException):
+            self.views.game_details(RequestFactory().get('/game/1000'), 1000)
+
+class DrinkingGameTests(TestCase):
+
+    def create_game(self, number_of_players=2, intoxication_level=10):
+        # Words that can be chosen by choose_less_or_more, the tests then call
+        # the other functions directly
+        words = [('word{}'.format(i), intoxication_level) for i in range(number_of_players)]
+        return DrinkingGame(None, words, number_of_players, intoxication_level)
+
+    def test_solutions_match_all_combinations(self):
+        game = self.create_game()
+        numbers = [1, 2, 3, 5, 8]
+        for goal, exact in [(10, True), (10, False), (4, False)]:
+            epsilon = 0 if exact else 2
+            expected = set(
+                combination
+                for size in range(1, 4)
+                for combination in itertools.combinations_with_replacement(numbers, size)
+                if abs(sum(combination) - goal) <= epsilon
+            )
+            solutions = game.get_solutions(numbers, goal, 3, exact=exact)
+            self.assertEqual(sorted(tuple(combination) for total, combination in solutions), sorted(expected))
+
+    def test_most_even_solutions_are_first(self):
+        solutions = self.create_game().get_solutions(range(1, 20), 18, 3, exact=True)
+        deviations = [statistics.pstdev(combination) for total, combination in solutions]
+        self.assertEqual(deviations, sorted(deviations))
+        self.assertEqual(deviations[0], 0)
+
+    def test_search_stops_when_time_budget_is_spent(self):
+        game = self.create_game()
+        game.solver_time_budget = 0
+        start = time.monotonic()
+        solutions = game.get_solutions(range(1, 2000), 3000, 3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertLess(len(solutions), 1000)
+
+    def test_players_get_different_words(self):
+        game = self.create_game(number_of_players=2, intoxication_level=10)
+        words = WordIndex([('{}{}'.format(occurrences, name), occurrences) for occurrences in [2, 3, 5] for name in 'abc'])
+        for i in range(20):
+            first, second = game.multiple_words(words)
+            self.assertEqual(sum(occurrences for word, occurrences in first), 10)
+            self.assertFalse(set(first) & set(second))
+
+    def test_words_are_repeated_when_there_are_no_other_words(self):
+        game = self.create_game(number_of_players=3, intoxication_level=10)
+        words = WordIndex([('a', 1), ('b', 2), ('c', 3), ('d', 5)])
+        for player_words in game.multiple_words(words):
+            self.assertEqual(sorted(player_words), [('b', 2), ('c', 3), ('d', 5)])
+
+    def test_many_players_share_words_evenly(self):
+        game = self.create_game(number_of_players=DrinkingGame.max_players, intoxication_level=10)
+        words = WordIndex([('{}{}'.format(occurrences, i), occurrences) for occurrences in [2, 3, 5] for i in range(10)])
+        counts = collections.Counter(word for player_words in game.multiple_words(words) for word in player_words)
+        for occurrences in [2, 3, 5]:
+            bucket_counts = [counts[word] for word in words.exact(occurrences)]
+            self.assertLessEqual(max(bucket_counts) - min(bucket_counts), 2)
+
+    def test_too_many_players_are_rejected(self):
+        with self.assertRaises(ParameterValueTooLargeException):
+            self.create_game(number_of_players=DrinkingGame.max_players + 1)
+
+class SubtitleStoreTests(TestCase):
+
+    def setUp(self):
+        self.subtitles = list(srt.parse(SUBTITLES))
+        self.path = write_temporary_file('', suffix='.subs')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, subtitles, compress=False):
+        with open(self.path, 'wb') as subtitle_file:
+            subtitle_store.write_subtitles(subtitles, subtitle_file, compress=compress)
+
+    def test_round_trip(self):
+        # Times that are not exact after conversion to floating point seconds
+        self.subtitles.extend(
+            srt.Subtitle(index, timedelta(milliseconds=milliseconds), timedelta(milliseconds=milliseconds + 1), 'text')
+            for index, milliseconds in enumerate([1001, 1015, 2002, 4004], start=len(self.subtitles) + 1)
+        )
+        for compress in [False, True]:
+            self.write(self.subtitles, compress=compress)
+            subtitles = list(subtitle_store.read_subtitles(self.path))
+            self.assertEqual(
+                [(subtitle.index, subtitle.start, subtitle.end) for subtitle in subtitles],
+                [(subtitle.index, subtitle.start, subtitle.end) for subtitle in self.subtitles]
+            )
+            self.assertEqual([subtitle.content for subtitle in subtitles], ['Hello there', '42', 'Good bye my friend'] + ['text'] * 4)
+
+    def test_compressed_file_is_smaller(self):
+        subtitles = self.subtitles * 100
+        self.write(subtitles)
+        size = os.path.getsize(self.path)
+        self.write(subtitles, compress=True)
+        self.assertLess(os.path.getsize(self.path), size)
+
+    def test_empty_subtitles(self):
+        # Cues without text are not stored
+        self.write([srt.Subtitle(1, timedelta(seconds=1), timedelta(seconds=2), '<i> </i>')])
+        self.assertEqual(list(subtitle_store.read_subtitles(self.path)), [])
+
+    def test_reader_can_stop_early(self):
+        self.write(self.subtitles)
+        subtitles = subtitle_store.read_subtitles(self.path)
+        self.assertEqual(next(subtitles).content, 'Hello there')
+
+        # The memory mapped file is closed even though not all cues were read
+        subtitles.close()
+        self.assertEqual(len(list(subtitle_store.read_subtitles(self.path))), 3)
+
+    def test_unknown_format_is_rejected(self):
+        with open(self.path, 'wb') as subtitle_file:
+            subtitle_file.write(SUBTITLES.encode('utf-8'))
+        with self.assertRaises(ValueError):
+            list(subtitle_store.read_subtitles(self.path))
+
+    def test_random_access(self):
+        self.write(self.subtitles)
+        with open(self.path, 'rb') as subtitle_file:
+            subtitles = subtitle_store.CompactSubtitles(subtitle_file.read())
+        self.assertEqual(len(subtitles), 3)
+        self.assertEqual(subtitles[2].end, timedelta(seconds=6))
+        self.assertEqual(subtitles.text(1), '42')
@@ -3,11 +3,15 @@ from . import views
 
 urlpatterns = [
     path('game', views.generate_game, name='generate_game'),
+    path('game/batch', views.generate_games, name='generate_games'),
     path('game/rate', views.rate_game, name='rate_game'),
     path('suggestions', views.suggestions, name='suggestions'),
     path('movie/trending', views.trending_movies, name='trending_movies'),
+    path('movie/<str:movie_id>/games', views.movie_games, name='movie_games'),
     path('game/<int:game_id>/', views.game_details, name='game_details'),
+    path('game/job/<int:job_id>', views.game_job, name='game_job'),
     path('share/<int:game_id>/', views.game_display, name='game_display'),
+    path('stats', views.server_stats, name='server_stats'),
 
     path('.well-known/assetlinks.json', views.asset_links, name='asset_links')
 ]
\ No newline at end of file
@@ -1,105 +1,185 @@
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 from .models import *
 from .exceptions import *
 
-from .subtitle_service import SubtitleService
-from .generator import DrinkingGame
+from .cache import MemoryCacheBackend, DjangoCacheBackend
+from .services import create_response_cache, create_subtitle_service, create_subtitle_analyzer, create_game_service
+from .jobs import GameJobRunner
+from .suggestion_index import SuggestionIndex
+from .ratings import RatingBuffer
+from .startup import timed, report
+
+from django.db.models.signals import post_save, post_delete
 
-from io import BytesIO
-import srt
 import json
+import math
+
+# Global services that are available to all views in this file, they are
+# configured from Django settings (see services)
+response_cache = create_response_cache()
+
+with timed('subtitle service'):
+    subtitle_service = create_subtitle_service(cache=response_cache)
+
+subtitle_analyzer = create_subtitle_analyzer()
+
+# NLP models are loaded lazily by default. When the web server loads the
+# application before forking workers (gunicorn --preload), they can be loaded
+# once in the master process and shared with the workers.
+if getattr(settings, 'NLP_PRELOAD', False):
+    with timed('NLP preload'):
+        subtitle_analyzer.preload()
+
+# Global game service that generates drinking games using the subtitle service
+game_service = create_game_service(subtitle_service, subtitle_analyzer)
+
+# Local autocomplete index over titles of movies in our database. It is built
+# on first search and kept up to date when movies and games are saved.
+suggestion_index = SuggestionIndex(refresh_interval=getattr(settings, 'SUGGESTIONS_REFRESH_INTERVAL', 60 * 60))
+post_save.connect(suggestion_index.movie_saved, sender=Movie, dispatch_uid='suggestion_index_movie_saved')
+post_delete.connect(suggestion_index.movie_deleted, sender=Movie, dispatch_uid='suggestion_index_movie_deleted')
+post_save.connect(suggestion_index.game_saved, sender=Game, dispatch_uid='suggestion_index_game_saved')
+
+# Maximum number of returned suggestions and minimum number of local matches
+# needed to skip the TMDB search
+SUGGESTIONS_LIMIT = getattr(settings, 'SUGGESTIONS_LIMIT', 10)
+SUGGESTIONS_MIN_LOCAL = getattr(settings, 'SUGGESTIONS_MIN_LOCAL', 5)
+
+# Maximum number of games that can be generated with one batch request
+GAME_BATCH_LIMIT = getattr(settings, 'GAME_BATCH_LIMIT', 20)
 
-# Global subtitle service for downloading and parsing subtitles that is
-# available to all views in this file
-subtitle_service = SubtitleService(
-    tmdb_api_key=settings.TMDB_API_KEY,
-    opensubtitles_username=settings.OPENSUBTITLES_USERNAME,
-    opensubtitles_password=settings.OPENSUBTITLES_PASSWORD
+# Serialized games that were requested most recently
+game_payload_cache = MemoryCacheBackend(getattr(settings, 'GAME_CACHE_SIZE', 1024))
+GAME_CACHE_TIMEOUT = getattr(settings, 'GAME_CACHE_TIMEOUT', 24 * 60 * 60)
+
+# Rendered share pages are cached in memory and optionally also in Django cache,
+# which can be shared between processes
+share_page_cache = MemoryCacheBackend(getattr(settings, 'SHARE_PAGE_CACHE_SIZE', 1024))
+shared_share_page_cache = None
+if getattr(settings, 'SHARE_PAGE_CACHE_ALIAS', None) is not None:
+    shared_share_page_cache = DjangoCacheBackend(settings.SHARE_PAGE_CACHE_ALIAS, prefix='share')
+SHARE_PAGE_TIMEOUT = getattr(settings, 'SHARE_PAGE_TIMEOUT', 7 * 24 * 60 * 60)
+
+# Ratings are saved to database in batches in the background
+rating_buffer = RatingBuffer(
+    flush_size=getattr(settings, 'RATING_FLUSH_SIZE', 100),
+    max_size=getattr(settings, 'RATING_BUFFER_SIZE', 10000),
+    flush_interval=getattr(settings, 'RATING_FLUSH_INTERVAL', 5),
+    max_attempts=getattr(settings, 'RATING_MAX_ATTEMPTS', 5)
+)
+
+# Games are rated with a rating bar in the app
+RATING_MIN = getattr(settings, 'RATING_MIN', 0)
+RATING_MAX = getattr(settings, 'RATING_MAX', 5)
+
+# Cache and rating buffer counters are only available if they are enabled
+STATS_ENABLED = getattr(settings, 'STATS_ENABLED', settings.DEBUG)
+
+# Background runner for games that are requested asynchronously
+game_job_runner = GameJobRunner(
+    game_service,
+    workers=getattr(settings, 'GAME_JOB_WORKERS', 4)
 )
 
+report()
+
+@csrf_exempt
 def generate_game(request):
     # When generating a game, a few parameters must first be read
     #   * movie - the name of the movie to generate game for
     #   * movie_id - the id of the movie the user wants to generate the game for
     #   * intoxication - number of shots the users wants to drink
     #   * players - number of players that the game must be generated for
-    movie_title = request.GET.get('movie', default=None)
-    intoxication_level = int(request.GET.get('intoxication', default=8))
-    number_of_players = int(request.GET.get('players', default=4))
+    parameters = request.POST if request.method == 'POST' else request.GET
+    movie_title = parameters.get('movie', default=None)
+    intoxication_level = int(parameters.get('intoxication', default=8))
+    number_of_players = int(parameters.get('players', default=4))
 
-    movie_id = request.GET.get('movie_id', default=None)
+    movie_id = parameters.get('movie_id', default=None)
 
-    # The movie_id argument is only present when user clicks on a suggestion
-    # card inside suggestions adapter in Android app. If both, movie_id and
-    # movie arguments are present, the movie_id parameter is used beucase it
-    # uniquely describes our movie.
-    if movie_id is not None:
-        try:
-            movie = Movie.objects.get(id=movie_id)
-        except Movie.DoesNotExist:
-            # There was an error loading movie from local database, get movie
-            # from TMDB service and save it to local database
-            movie = subtitle_service.get_movie(movie_id)
-            movie.save()
-    else:
-        # If movie_id is None and movie_title isn't, then we must perform two
-        # requests to TMDB API. First, we use movie_title to get a list of
-        # suggestions and then use the most probable suggestion from this list.
-        if movie_title is not None:
-            suggestions, _ = subtitle_service.get_suggestions(movie_title)
-
-            if suggestions is None or len(suggestions) <= 0:
-                raise MovieNotFoundException(movie_title)
-            
-            movie = subtitle_service.get_movie(suggestions[0].id)
-            movie.save()
-        else:
-            raise InvalidParametersException('movie or movie_id')
-
-    # After movie information has either been downloaded or read from local
-    # database, find its subtitles. The subtitles might have already been
-    # downloaded. In this case, only the game needs to be generated.
-    if movie.subtitles_file:
-        subtitle_file_path = movie.subtitles_file.url
-        with open(subtitle_file_path, 'r', encoding='utf-8') as subtitle_file:
-            subtitle_generator = srt.parse(subtitle_file.read())
-    else:
-        subtitle_file_content, subtitle_generator = subtitle_service.get_subtitles(movie)
-
-        file_io = BytesIO(subtitle_file_content)
-        movie.subtitles_file.save(
-            "{}.srt".format(movie.id),
-            content = ContentFile(file_io.getvalue())
+    # POST requests generate the game in the background. The job id is
+    # returned immediately and the client polls the game_job endpoint.
+    if request.method == 'POST':
+        job = game_job_runner.submit(
+            movie_id,
+            movie_title,
+            number_of_players,
+            intoxication_level,
+            created_by=request.api_user
         )
-    
-    # Here, subtitle generator has been created, now we can create game
-    game = DrinkingGame(
+        return JsonResponse(job.to_dict(), status=202)
+
+    movie = game_service.get_movie(movie_id=movie_id, movie_title=movie_title)
+    game = game_service.get_game(
         movie,
-        subtitle_generator,
         number_of_players,
-        intoxication_level
-    )
-    game_json = game.to_dict(subtitle_service)
-
-    # If there was an exception during game generation process, Django will exit
-    # here. Once game has been successfully generated, we can save it to local
-    # database. The game id will be generated automatically by Django.
-    game_database = Game(
-        number_of_players=game.number_of_players,
-        intoxication_level=game.intoxication_level,
-        number_of_bonus_words=game.number_of_bonus_words,
-        game_data=json.dumps(game_json),
-        movie=movie,
+        intoxication_level,
         created_by=request.api_user
     )
-    game_database.save()
+    return JsonResponse(game.to_dict())
+
+def game_job(request, job_id):
+    # Jobs that were lost when a web server worker was restarted are reported
+    # as failed instead of pending forever
+    job = game_job_runner.get_job(job_id)
+    return JsonResponse(job.to_dict())
+
+@csrf_exempt
+def generate_games(request):
+    # Multiple games for the same movie are generated from a JSON request
+    # body with the following fields
+    #   * movie or movie_id - the movie to generate games for (see generate_game)
+    #   * variants - list of objects with players, intoxication and
+    #     bonus_words fields
+    try:
+        parameters = json.loads(request.body.decode('utf-8'))
+        variants = [
+            (
+                int(variant.get('players', 4)),
+                int(variant.get('intoxication', 8)),
+                int(variant.get('bonus_words', 1))
+            ) for variant in parameters['variants']
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidParametersException('variants')
+
+    if len(variants) <= 0:
+        raise InvalidParametersException('variants')
+
+    if len(variants) > GAME_BATCH_LIMIT:
+        raise BatchTooLargeException(GAME_BATCH_LIMIT)
+
+    movie_id = parameters.get('movie_id', None)
+    movie = game_service.get_movie(
+        movie_id=str(movie_id) if movie_id is not None else None,
+        movie_title=parameters.get('movie', None)
+    )
+    results = game_service.generate_games(movie, variants, created_by=request.api_user)
+
+    games = []
+    for (number_of_players, intoxication_level, number_of_bonus_words), result in zip(variants, results):
+        game = {
+            "players": number_of_players,
+            "intoxication": intoxication_level,
+            "bonus_words": number_of_bonus_words
+        }
+        if isinstance(result, ApiException):
+            game['error'] = result.to_dict()
+        else:
+            game['id'] = str(result.id)
+        games.append(game)
 
-    game_json['id'] = str(game_database.id)
-    return JsonResponse(game_json)
+    return JsonResponse({
+        "movie": movie.to_dict(subtitle_service, 0),
+        "games": games
+    })
 
 def rate_game(request):
     game_id = request.GET.get('game', default=None)
@@ -112,11 +192,23 @@ def rate_game(request):
         raise InvalidParametersException('rating')
 
     try:
-        game = Game.objects.get(id=int(game_id))
-        rating_database = Rating(user=request.api_user, game=game, rating=rating)
-        rating_database.save()
-    except Exception:
-        pass
+        value = float(rating)
+    except ValueError:
+        raise InvalidParametersException('rating')
+
+    # Ratings outside of the rating bar range (including nan and infinity)
+    # would break the rating aggregates
+    if not math.isfinite(value) or not RATING_MIN <= value <= RATING_MAX:
+        raise InvalidParametersException('rating')
+
+    try:
+        game = int(game_id)
+    except ValueError:
+        raise GameNotFoundException(game_id)
+
+    # Ratings are saved in batches by the rating buffer, ratings of games that
+    # do not exist are dropped at that time
+    rating_buffer.add(request.api_user.id, game, value)
 
     return JsonResponse({
         'game': game_id,
@@ -129,7 +221,14 @@ def suggestions(request):
     if not keywords:
         raise InvalidParametersException('keywords')
 
-    suggestions, response = subtitle_service.get_suggestions(keywords)
+    # Movies from local database are suggested first, TMDB is only queried if
+    # there are not enough local matches
+    suggestions = suggestion_index.search(keywords, limit=SUGGESTIONS_LIMIT)
+    if len(suggestions) < SUGGESTIONS_MIN_LOCAL:
+        local_ids = set(str(suggestion.id) for suggestion in suggestions)
+        remote_suggestions, response = subtitle_service.get_suggestions(keywords)
+        suggestions.extend(suggestion for suggestion in remote_suggestions if str(suggestion.id) not in local_ids)
+
     return JsonResponse([suggestion.to_dict(subtitle_service, 0) for suggestion in suggestions], safe=False)
 
 def trending_movies(request):
@@ -137,41 +236,112 @@ def trending_movies(request):
     return JsonResponse(subtitle_service.get_popular(page), safe=False)
 
 def game_details(request, game_id):
+    # Games never change after they are created, so the most requested ones
+    # are kept in memory as ready to send bytes together with their ETag and
+    # modification time
+    cached_game = game_payload_cache.get(game_id)
+    if cached_game is None:
+        try:
+            game = Game.objects.get(pk=game_id)
+        except Game.DoesNotExist:
+            raise GameNotFoundException(game_id)
+
+        if not game.serialized:
+            game.serialize()
+            game.save(update_fields=['game_data', 'serialized', 'updated_at'])
+
+        last_modified = int(game.updated_at.timestamp())
+        etag = quote_etag('game-{}-{}'.format(game.id, last_modified))
+        cached_game = (game.game_data.encode('utf-8'), etag, last_modified)
+        game_payload_cache.set(game_id, cached_game, GAME_CACHE_TIMEOUT)
+
+    payload, etag, last_modified = cached_game
+
+    # Clients that already have the game receive an empty 304 response
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(payload, content_type='application/json')
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, max_age=GAME_CACHE_TIMEOUT)
+    return response
+
+def movie_games(request, movie_id):
+    # Best rated games for movie, the limit parameter is the maximum number of
+    # returned games
     try:
-        game = Game.objects.get(pk=game_id)
-        game_json = json.loads(game.game_data)
-        game_json['id'] = str(game.id)
-        return JsonResponse(game_json, safe=False)
-    except Game.DoesNotExist:
-        raise GameNotFoundException(game_id)
+        limit = max(1, min(int(request.GET.get('limit', default=10)), 50))
+    except ValueError:
+        raise InvalidParametersException('limit')
+
+    games = Game.objects.filter(movie_id=movie_id).order_by('-rating_average', '-rating_count')[:limit]
+
+    games_json = []
+    for game in games:
+        game_json = game.to_dict()
+        game_json['rating'] = game.rating_average
+        game_json['number_of_ratings'] = game.rating_count
+        games_json.append(game_json)
+
+    return JsonResponse(games_json, safe=False)
+
+def render_share_page(game):
+    game_json = game.to_dict()
+
+    words, shots, colors = [], [], []
+    # Games without bonus words (or without any words) are displayed too
+    hue_difference = 360.0 / max(len(game_json['words']), 1)
+    for index, player in enumerate(game_json['words']):
+        player_words = [word['word'] for word in player]
+        player_shots = [word['occurrences'] for word in player]
+        words.append(', '.join(player_words))
+        shots.append(sum(player_shots))
+        colors.append('hsl({}, 100%, 70%)'.format(index * hue_difference))
+
+    bonus_words, bonus_colors = [], []
+    hue_difference = 360.0 / max(len(game_json['bonus_words']), 1)
+    for index, bonus_word in enumerate(game_json['bonus_words']): 
+        bonus_words.append(bonus_word['word'])
+        bonus_colors.append('hsl({}, 100%, 70%)'.format(index * hue_difference))
+    
+    players = list(zip(words, shots, colors))
+    bonus = list(zip(bonus_words, bonus_colors))
+    
+    return render_to_string('share.html', { 'json': game_json, 'game': game, 'players': players, 'bonus_words': bonus })
 
 def game_display(request, game_id):
-    try:
-        game = Game.objects.get(pk=game_id)
-        game_json = json.loads(game.game_data)
-        game_json['id'] = str(game.id)
-
-        words, shots, colors = [], [], []
-        hue_difference = 360.0 / len(game_json['words'])
-        for index, player in enumerate(game_json['words']):
-            player_words = [word['word'] for word in player]
-            player_shots = [word['occurrences'] for word in player]
-            words.append(', '.join(player_words))
-            shots.append(sum(player_shots))
-            colors.append('hsl({}, 100%, 70%)'.format(index * hue_difference))
-
-        bonus_words, bonus_colors = [], []
-        hue_difference = 360.0 / len(game_json['bonus_words'])
-        for index, bonus_word in enumerate(game_json['bonus_words']): 
-            bonus_words.append(bonus_word['word'])
-            bonus_colors.append('hsl({}, 100%, 70%)'.format(index * hue_difference))
-        
-        players = list(zip(words, shots, colors))
-        bonus = list(zip(bonus_words, bonus_colors))
-        
-        return render(request, 'share.html', { 'json': game_json, 'game': game, 'players': players, 'bonus_words': bonus })
-    except Exception as e:
-        return render(request, 'get_from_google_play.html')
+    # Games never change, so each share page is only rendered once and then
+    # served from memory or from the shared Django cache
+    html = share_page_cache.get(game_id)
+    if html is None and shared_share_page_cache is not None:
+        html = shared_share_page_cache.get(game_id)
+        if html is not None:
+            share_page_cache.set(game_id, html, SHARE_PAGE_TIMEOUT)
+
+    if html is None:
+        try:
+            game = Game.objects.select_related('movie').get(pk=game_id)
+            html = render_share_page(game)
+        except Exception as e:
+            return render(request, 'get_from_google_play.html')
+
+        share_page_cache.set(game_id, html, SHARE_PAGE_TIMEOUT)
+        if shared_share_page_cache is not None:
+            shared_share_page_cache.set(game_id, html, SHARE_PAGE_TIMEOUT)
+
+    response = HttpResponse(html)
+    patch_cache_control(response, public=True, max_age=SHARE_PAGE_TIMEOUT)
+    return response
+
+def server_stats(request):
+    if not STATS_ENABLED:
+        raise Http404()
+
+    return JsonResponse({
+        "tmdb_cache": response_cache.stats(),
+        "ratings": rating_buffer.stats()
+    })
 
 def asset_links(request):
     return JsonResponse(settings.DIGITAL_ASSET_LINKS_FILE_CONTENT, safe=False)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""Generate the synthetic sample subtitles used by the benchmarks
+
+Real subtitles can not be redistributed, so the sample files are generated
+from a small grammar. Word frequencies follow a Zipf-like distribution, similar
+to real movie dialogue, so games can be generated for a wide range of
+intoxication levels. The output is deterministic for a given seed.
+"""
+import argparse
+import os
+import random
+
+NAMES = ['John', 'Sarah', 'Mike', 'Anna', 'Doctor Brown', 'Captain', 'Emma', 'Frank']
+
+NOUNS = [
+    'car', 'money', 'house', 'gun', 'door', 'phone', 'night', 'job', 'girl', 'boy',
+    'city', 'plan', 'truth', 'dog', 'ship', 'road', 'friend', 'father', 'mother', 'brother',
+    'sister', 'bank', 'police', 'war', 'time', 'machine', 'key', 'box', 'letter', 'picture',
+    'island', 'river', 'window', 'train', 'hospital', 'school', 'office', 'restaurant', 'bar', 'drink',
+    'coffee', 'beer', 'whiskey', 'bottle', 'glass', 'table', 'chair', 'bed', 'room', 'kitchen',
+    'garden', 'tree', 'forest', 'mountain', 'sea', 'beach', 'sun', 'moon', 'star', 'sky',
+    'rain', 'snow', 'storm', 'fire', 'water', 'blood', 'heart', 'head', 'hand', 'eye',
+    'face', 'voice', 'name', 'word', 'book', 'story', 'song', 'music', 'movie', 'game',
+    'ball', 'team', 'boss', 'president', 'king', 'queen', 'army', 'soldier', 'agent', 'spy',
+    'lawyer', 'judge', 'prison', 'cop', 'thief', 'killer', 'monster', 'alien', 'robot', 'ghost',
+    'wedding', 'party', 'birthday', 'christmas', 'dinner', 'breakfast', 'lunch', 'pizza', 'cake', 'chicken',
+    'horse', 'cat', 'bird', 'fish', 'shark', 'dragon', 'sword', 'ring', 'crown', 'treasure',
+    'map', 'compass', 'plane', 'helicopter', 'bomb', 'bullet', 'knife', 'rope', 'camera', 'computer',
+    'file', 'secret', 'mission', 'target', 'signal', 'radio', 'engine', 'wheel', 'bridge', 'tunnel',
+]
+
+VERBS = ['find', 'take', 'need', 'want', 'see', 'lose', 'get', 'bring', 'keep', 'stop', 'remember', 'leave']
+ADJECTIVES = ['old', 'new', 'big', 'little', 'red', 'dark', 'strange', 'last', 'first', 'broken']
+
+TEMPLATES = [
+    'We need to {verb} the {noun}.',
+    'Where is the {noun}?',
+    '{name}, the {noun} is {adjective}.',
+    'I can\'t {verb} the {noun} without the {noun2}.',
+    'Did you {verb} my {noun}?',
+    'The {adjective} {noun} was in the {noun2}.',
+    'Give me the {noun}, {name}!',
+    'You said the {noun} would {verb} the {noun2}.',
+    '{number} {noun}s. That\'s all we have.',
+    'Okay.',
+    'No, no, no...',
+    '- What?\n- The {noun}!',
+]
+
+def format_time(seconds):
+    milliseconds = int(seconds * 1000)
+    return '{:02d}:{:02d}:{:02d},{:03d}'.format(
+        milliseconds // 3600000,
+        milliseconds // 60000 % 60,
+        milliseconds // 1000 % 60,
+        milliseconds % 1000
+    )
+
+def generate(cues, seed):
+    generator = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(NOUNS))]
+
+    def noun():
+        return generator.choices(NOUNS, weights=weights, k=1)[0]
+
+    lines = []
+    time = 5.0
+    for index in range(1, cues + 1):
+        text = generator.choice(TEMPLATES).format(
+            name=generator.choice(NAMES),
+            noun=noun(),
+            noun2=noun(),
+            verb=generator.choice(VERBS),
+            adjective=generator.choice(ADJECTIVES),
+            number=generator.randint(2, 99)
+        )
+        duration = generator.uniform(1.0, 4.0)
+        lines.append('{}\n{} --> {}\n{}\n'.format(index, format_time(time), format_time(time + duration), text))
+        time += duration + generator.uniform(0.2, 2.5)
+    return '\n'.join(lines)
+
+# Number of cues for each sample, roughly a short film, an average feature
+# film and a very long film
+SAMPLES = {
+    'short': 250,
+    'average': 1400,
+    'long': 3200,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subtitles'))
+    parser.add_argument('--seed', type=int, default=2020)
+    arguments = parser.parse_args()
+
+    os.makedirs(arguments.output, exist_ok=True)
+    for name, cues in SAMPLES.items():
+        path = os.path.join(arguments.output, '{}.srt'.format(name))
+        with open(path, 'w', encoding='utf-8') as subtitle_file:
+            subtitle_file.write(generate(cues, arguments.seed))
+        print('Generated {} ({} cues)'.format(path, cues))
@@ -0,0 +1,168 @@
+"""Benchmark the drinking game generation pipeline
+
+Each stage of the pipeline (subtitle parsing, loading subtitles in compact
+format, tokenization, part of speech tagging, word counting and word selection) is timed on the sample subtitles in
+benchmarks/subtitles. No network access or database is needed.
+
+Usage:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 0.2
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIRECTORY))
+
+import nltk
+import srt
+
+from api.exceptions import ApiException
+from api.generator import DrinkingGame, WordIndex, WORD_FINDERS
+from api.subtitle_store import CompactSubtitles, write_subtitles
+
+def measure(function, repeat):
+    # The fastest run is reported, because slower runs are mostly caused by
+    # other processes on the machine
+    best_time, result = None, None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        duration = time.perf_counter() - start
+        best_time = duration if best_time is None else min(best_time, duration)
+
+    # Memory is measured in a separate run, because tracing allocations slows
+    # down the code
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, best_time, peak_memory
+
+def stage_result(seconds, peak_memory, amount, unit):
+    return {
+        "seconds": seconds,
+        "throughput": amount / seconds if seconds > 0 else None,
+        "unit": unit,
+        "peak_memory": peak_memory
+    }
+
+def benchmark_subtitles(path, word_finders, players, intoxication_levels, games, repeat):
+    with open(path, 'r', encoding='utf-8') as subtitle_file:
+        text = subtitle_file.read()
+
+    results = {}
+
+    subtitles, seconds, memory = measure(lambda: list(srt.parse(text)), repeat)
+    results['parse'] = stage_result(seconds, memory, len(subtitles), 'cues/s')
+
+    compact_file = io.BytesIO()
+    write_subtitles(subtitles, compact_file)
+    _, seconds, memory = measure(lambda: list(CompactSubtitles(compact_file.getvalue())), repeat)
+    results['load'] = stage_result(seconds, memory, len(subtitles), 'cues/s')
+
+    tokens, seconds, memory = measure(lambda: [nltk.word_tokenize(subtitle.content) for subtitle in subtitles], repeat)
+    results['tokenize'] = stage_result(seconds, memory, len(subtitles), 'cues/s')
+
+    tagger = WORD_FINDERS['nltk']().tagger
+    _, seconds, memory = measure(lambda: [tagger.tag(cue_tokens) for cue_tokens in tokens], repeat)
+    results['tag'] = stage_result(seconds, memory, sum(len(cue_tokens) for cue_tokens in tokens), 'tokens/s')
+
+    for name in word_finders:
+        word_finder = WORD_FINDERS[name]()
+        words, seconds, memory = measure(lambda: word_finder.get_words(subtitles), repeat)
+        results['count_{}'.format(name)] = stage_result(seconds, memory, len(subtitles), 'cues/s')
+
+        # Generate a number of games for each combination of parameters and
+        # count the ones that could not be generated
+        failures = {}
+        def select_words():
+            index = WordIndex(words)
+            for number_of_players in players:
+                for intoxication_level in intoxication_levels:
+                    key = '{}x{}'.format(number_of_players, intoxication_level)
+                    failures[key] = 0
+                    for i in range(games):
+                        try:
+                            DrinkingGame(None, index, number_of_players, intoxication_level)
+                        except ApiException:
+                            failures[key] += 1
+
+        _, seconds, memory = measure(select_words, repeat)
+        total_games = len(players) * len(intoxication_levels) * games
+        results['select_{}'.format(name)] = stage_result(seconds, memory, total_games, 'games/s')
+        results['select_{}'.format(name)]['failures'] = failures
+
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print stages that are slower than in the baseline and return their number"""
+    regressions = 0
+    for sample, stages in results.items():
+        for stage, result in stages.items():
+            baseline_result = baseline.get(sample, {}).get(stage, None)
+            if baseline_result is None or not baseline_result['seconds']:
+                continue
+
+            ratio = result['seconds'] / baseline_result['seconds']
+            status = 'ok'
+            if ratio > 1 + tolerance:
+                status = 'REGRESSION'
+                regressions += 1
+            print('{:<10} {:<16} {:>8.3f}s {:>8.3f}s {:>6.2f}x {}'.format(
+                sample, stage, result['seconds'], baseline_result['seconds'], ratio, status
+            ))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subtitles', nargs='*', default=sorted(glob.glob(os.path.join(BENCHMARKS_DIRECTORY, 'subtitles', '*.srt'))))
+    parser.add_argument('--word-finders', nargs='*', default=list(WORD_FINDERS), choices=list(WORD_FINDERS))
+    parser.add_argument('--players', nargs='*', type=int, default=[2, 4, 6])
+    parser.add_argument('--intoxication', nargs='*', type=int, default=[4, 8, 16, 32])
+    parser.add_argument('--games', type=int, default=20, help='Number of games generated for each combination of parameters')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Path of JSON file the results are written to')
+    parser.add_argument('--baseline', help='Path of JSON file with results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown compared to baseline')
+    arguments = parser.parse_args()
+
+    results = {}
+    for path in arguments.subtitles:
+        sample = os.path.splitext(os.path.basename(path))[0]
+        results[sample] = benchmark_subtitles(
+            path,
+            arguments.word_finders,
+            arguments.players,
+            arguments.intoxication,
+            arguments.games,
+            arguments.repeat
+        )
+        for stage, result in results[sample].items():
+            print('{:<10} {:<16} {:>8.3f}s {:>12.1f} {:<9} {:>8.1f} KiB'.format(
+                sample, stage, result['seconds'], result['throughput'] or 0, result['unit'], result['peak_memory'] / 1024
+            ))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "results": results
+    }
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline['results'], arguments.tolerance) > 0:
+            sys.exit(1)